@@ -0,0 +1,81 @@
+"""
+In-process caching for upstream API calls.
+"""
+
+import asyncio
+import functools
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+
+def async_ttl_cache(ttl: float, key: Optional[Callable[..., Hashable]] = None) -> Callable:
+    """
+    Cache an async function's result for `ttl` seconds, keyed on its arguments.
+
+    Callers that miss on the same key while a call is in flight await that same
+    call (single-flight), so a burst of requests turns into one upstream request.
+    The TTL starts when the call finishes; failures are not cached.
+
+    `key`, if given, builds the cache key from the call's arguments - for
+    unhashable arguments, or to let near-identical calls share an entry.
+    Otherwise the arguments themselves are the key.
+
+    The wrapper also gets `cached(...)`, which returns a fresh finished result
+    without calling anything (None on a miss), and `refresh(...)`, which always
+    calls through and replaces the cached entry.
+    """
+    def decorator(func: Callable) -> Callable:
+        # key -> [expires_at, future]; expires_at is infinite while in flight
+        entries: Dict[Hashable, List[Any]] = {}
+
+        def make_key(args: tuple, kwargs: Dict[str, Any]) -> Hashable:
+            if key is None:
+                return (args, tuple(sorted(kwargs.items())))
+            return key(*args, **kwargs)
+
+        def start(cache_key: Hashable, args: tuple, kwargs: Dict[str, Any]) -> List[Any]:
+            # Drop anything else that has expired so the dict can't grow unbounded
+            now = time.monotonic()
+            for stale in [k for k, (expires_at, _) in entries.items() if expires_at <= now]:
+                del entries[stale]
+
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            entry = entries[cache_key] = [float("inf"), future]
+
+            def on_done(done: asyncio.Future, entry: List[Any] = entry) -> None:
+                if done.cancelled() or done.exception() is not None:
+                    if entries.get(cache_key) is entry:
+                        del entries[cache_key]
+                else:
+                    entry[0] = time.monotonic() + ttl
+
+            future.add_done_callback(on_done)
+            return entry
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            cache_key = make_key(args, kwargs)
+            entry = entries.get(cache_key)
+            if entry is None or entry[0] <= time.monotonic():
+                entry = start(cache_key, args, kwargs)
+
+            # Shield so one caller disconnecting doesn't cancel the shared call
+            return await asyncio.shield(entry[1])
+
+        def cached(*args, **kwargs) -> Optional[Any]:
+            """The finished, unexpired result for these arguments, or None."""
+            entry = entries.get(make_key(args, kwargs))
+            if entry is None or not entry[1].done() or entry[0] <= time.monotonic():
+                return None
+            return entry[1].result()
+
+        async def refresh(*args, **kwargs):
+            """Call through even if a result is cached, and cache the new one."""
+            entry = start(make_key(args, kwargs), args, kwargs)
+            return await asyncio.shield(entry[1])
+
+        wrapper.cached = cached
+        wrapper.refresh = refresh
+        return wrapper
+
+    return decorator
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from pydantic import model_validator
+from pydantic import Field, model_validator
 from functools import lru_cache
 
 
@@ -8,6 +8,9 @@ class Settings(BaseSettings):
 
     xai_api_key: str = ""
     xai_model: str = "grok-4-1-fast-reasoning-latest"  # AI model for analysis
+    # Optional model tiers, routed by market difficulty (blank = use xai_model)
+    xai_fast_model: str = ""  # Lopsided, quiet markets; web search only
+    xai_premium_model: str = ""  # Highly competitive markets
     database_url: str = "sqlite:///./polyagent.db"
     initial_balance: float = 100000.0  # Starting virtual USDC ($100K)
 
@@ -18,6 +21,10 @@ class Settings(BaseSettings):
     # Cache settings
     cache_ttl: int = 60  # Market data cache TTL in seconds
 
+    # Outbound xAI throttling, across all analyses in this process
+    xai_max_concurrency: int = Field(8, ge=1)  # Max xAI requests in flight at once
+    xai_rpm: int = Field(60, ge=1)  # Max xAI requests started per minute
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
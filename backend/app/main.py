@@ -1,27 +1,32 @@
-from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from sqlalchemy import func, select, update
 from sqlalchemy.orm import Session
 from contextlib import asynccontextmanager
-from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
 from collections import defaultdict, deque
-from functools import partial
 import asyncio
+import sys
 import time
 import json
 import logging
-from typing import List, Optional, Dict, Any, Deque
+import orjson
+from typing import List, Dict, Any, Deque, Optional
 
 from .database import get_db, init_db, SessionLocal
 from .models import Portfolio, Trade, AnalysisLog, TradeDirection, TradeStatus
 from .schemas import (
-    AnalyzeRequest, AnalysisResult, SimulateTradeRequest,
-    TradeResponse, PortfolioInfo, TradeInfo, MarketInfo, ResetResponse, PriceUpdateResponse,
-    CalculateReturnRequest, CalculateReturnResponse
+    AnalyzeRequest, AnalyzeBatchRequest, AnalysisResult, SimulateTradeRequest,
+    TradeResponse, PortfolioInfo, TradeInfo, MarketInfo, MarketOpportunity, ResetResponse,
+    PriceUpdateResponse, CalculateReturnRequest, CalculateReturnResponse
 )
-from .services import xai_service, polymarket_service, market_analyzer
 from .config import get_settings
 
+# Service modules are imported inside the handlers that use them: xai_service
+# pulls in the xAI SDK (gRPC/protobuf) and the Polymarket services pull in
+# httpx, which together dominate import time and slow down `--reload` restarts.
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -29,19 +34,30 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Simple in-memory cache for market data
-_market_cache: Dict[str, Any] = {"data": None, "timestamp": None}
+settings = get_settings()
+
+# Simple in-memory cache for the serialized /markets JSON body.
+# Hits return the stored bytes directly, so FastAPI skips response_model
+# validation and serialization entirely.
+_market_cache: Dict[str, Any] = {"body": None, "expires_at": 0.0}
 
-# Thread pool for running synchronous AI calls without blocking
-_executor = ThreadPoolExecutor(max_workers=4)
+# Decimal quantization steps for /calculate-return (shares to 6dp, USDC to cents)
+_SHARES_QUANTUM = Decimal('0.000001')
+_CENTS_QUANTUM = Decimal('0.01')
 
 # Rate limiter using deque for O(1) cleanup from front
 _rate_limit_store: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=100))
 
-def check_rate_limit(client_ip: str, endpoint: str, max_requests: int, window_seconds: int) -> bool:
-    """Check if client has exceeded rate limit. Returns True if allowed, False if exceeded."""
+# All endpoints rate limit over the same one-minute window
+RATE_LIMIT_WINDOW = 60
+
+def check_rate_limit(client_ip: str, endpoint: str, max_requests: int, window_seconds: int, cost: int = 1) -> bool:
+    """
+    Check if client has exceeded rate limit. Returns True if allowed, False if exceeded.
+    A request worth `cost` requests is recorded only if all of them fit.
+    """
     key = f"{client_ip}:{endpoint}"
-    now = time.time()
+    now = time.monotonic()
     window_start = now - window_seconds
 
     requests = _rate_limit_store[key]
@@ -51,13 +67,32 @@ def check_rate_limit(client_ip: str, endpoint: str, max_requests: int, window_se
         requests.popleft()
 
     # Check limit
-    if len(requests) >= max_requests:
+    if len(requests) + cost > max_requests:
         return False
 
     # Record request
-    requests.append(now)
+    requests.extend([now] * cost)
     return True
 
+
+def record_requests(client_ip: str, endpoint: str, count: int) -> None:
+    """Count `count` requests that were already made against the client's rate limit."""
+    _rate_limit_store[f"{client_ip}:{endpoint}"].extend([time.monotonic()] * count)
+
+async def _sweep_rate_limits(window_seconds: int) -> None:
+    """Periodically drop rate limit entries for clients idle longer than the window."""
+    while True:
+        await asyncio.sleep(window_seconds)
+        window_start = time.monotonic() - window_seconds
+        idle_keys = [
+            key for key, requests in _rate_limit_store.items()
+            if not requests or requests[-1] < window_start
+        ]
+        for key in idle_keys:
+            del _rate_limit_store[key]
+        if idle_keys:
+            logger.debug("Dropped %d idle rate limit entries", len(idle_keys))
+
 def get_client_ip(request: Request) -> str:
     """Get client IP from request."""
     forwarded = request.headers.get("X-Forwarded-For")
@@ -76,24 +111,32 @@ async def lifespan(app: FastAPI):
     try:
         portfolio = db.query(Portfolio).first()
         if not portfolio:
-            settings = get_settings()
             portfolio = Portfolio(balance=settings.initial_balance)
             db.add(portfolio)
             db.commit()
-            logger.info(f"Initialized portfolio with balance: ${settings.initial_balance:,.2f}")
+            logger.info("Initialized portfolio with balance: $%.2f", settings.initial_balance)
     finally:
         db.close()
+    sweeper = asyncio.create_task(_sweep_rate_limits(RATE_LIMIT_WINDOW))
     logger.info("Server startup complete")
     yield
     # Shutdown
     logger.info("Shutting down PolyAgent Sim server...")
+    sweeper.cancel()
+    # Only close clients of services that were actually imported, so a reload
+    # that never served a request doesn't pay for the imports here
+    for name in ("polymarket_service", "xai_service"):
+        service = sys.modules.get(f"{__package__}.services.{name}")
+        if service is not None:
+            await service.close_client()
 
 
 app = FastAPI(
     title="PolyAgent Sim",
     description="Polymarket Value-Betting AI Simulator",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS for frontend
@@ -114,49 +157,47 @@ def root():
 @app.get("/markets", response_model=List[MarketInfo])
 async def get_markets(request: Request):
     """Fetch active markets from Polymarket with caching (top 100 by volume)."""
-    settings = get_settings()
+    from .services import polymarket_service
 
     # Rate limit using configurable settings
     client_ip = get_client_ip(request)
-    if not check_rate_limit(client_ip, "markets", max_requests=settings.rate_limit_markets, window_seconds=60):
+    if not check_rate_limit(client_ip, "markets", max_requests=settings.rate_limit_markets, window_seconds=RATE_LIMIT_WINDOW):
         raise HTTPException(
             status_code=429,
             detail=f"Rate limit exceeded. Maximum {settings.rate_limit_markets} market requests per minute."
         )
 
-    now = datetime.now()
-
-    # Check cache - return cached data if still valid (TTL from settings)
-    if (_market_cache["data"] is not None and
-        _market_cache["timestamp"] is not None and
-        (now - _market_cache["timestamp"]).total_seconds() < settings.cache_ttl):
-        return _market_cache["data"]
+    # Check cache - return cached body if still valid (TTL from settings)
+    if _market_cache["body"] is not None and time.monotonic() < _market_cache["expires_at"]:
+        return Response(content=_market_cache["body"], media_type="application/json")
 
     # Fetch fresh data - increased limit to 100 to show more markets
     try:
         markets = await polymarket_service.fetch_active_markets(limit=100)
-        result = [MarketInfo(**m) for m in markets]
+        # Our own parser already produced clean, typed values - skip revalidation
+        result = [MarketInfo.model_construct(**m) for m in markets]
+        body = orjson.dumps([r.model_dump(mode="json") for r in result])
 
         # Update cache
-        _market_cache["data"] = result
-        _market_cache["timestamp"] = now
+        _market_cache["body"] = body
+        _market_cache["expires_at"] = time.monotonic() + settings.cache_ttl
 
-        return result
+        return Response(content=body, media_type="application/json")
     except Exception as e:
         # Return stale cache if available on error
-        if _market_cache["data"] is not None:
-            return _market_cache["data"]
+        if _market_cache["body"] is not None:
+            return Response(content=_market_cache["body"], media_type="application/json")
         raise HTTPException(status_code=500, detail=f"Failed to fetch markets: {str(e)}")
 
 
 @app.get("/markets/search", response_model=List[MarketInfo])
 async def search_markets(request: Request, q: str):
     """Search for markets by keyword. Searches event titles and market questions."""
-    settings = get_settings()
+    from .services import polymarket_service
 
     # Rate limit
     client_ip = get_client_ip(request)
-    if not check_rate_limit(client_ip, "search", max_requests=settings.rate_limit_markets, window_seconds=60):
+    if not check_rate_limit(client_ip, "search", max_requests=settings.rate_limit_markets, window_seconds=RATE_LIMIT_WINDOW):
         raise HTTPException(
             status_code=429,
             detail=f"Rate limit exceeded. Maximum {settings.rate_limit_markets} search requests per minute."
@@ -167,13 +208,18 @@ async def search_markets(request: Request, q: str):
 
     try:
         markets = await polymarket_service.search_markets(query=q, limit=50)
-        return [MarketInfo(**m) for m in markets]
+        # Serialize directly like /markets so FastAPI doesn't validate the list again
+        result = [MarketInfo.model_construct(**m) for m in markets]
+        return Response(
+            content=orjson.dumps([r.model_dump(mode="json") for r in result]),
+            media_type="application/json"
+        )
     except Exception as e:
-        logger.error(f"Search failed for query '{q}': {str(e)}")
+        logger.error("Search failed for query '%s': %s", q, e)
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
 
-@app.get("/markets/top")
+@app.get("/markets/top", response_model=List[MarketOpportunity])
 async def get_top_opportunities(request: Request, limit: int = 10):
     """
     Get top trading opportunities ranked by opportunity score.
@@ -181,11 +227,11 @@ async def get_top_opportunities(request: Request, limit: int = 10):
     Analyzes markets based on: momentum, volume, liquidity, spread,
     uncertainty (prices near 50%), timing (days to resolution), and engagement.
     """
-    settings = get_settings()
+    from .services import market_analyzer
 
     # Rate limit
     client_ip = get_client_ip(request)
-    if not check_rate_limit(client_ip, "top", max_requests=settings.rate_limit_markets, window_seconds=60):
+    if not check_rate_limit(client_ip, "top", max_requests=settings.rate_limit_markets, window_seconds=RATE_LIMIT_WINDOW):
         raise HTTPException(
             status_code=429,
             detail=f"Rate limit exceeded. Maximum {settings.rate_limit_markets} requests per minute."
@@ -196,169 +242,275 @@ async def get_top_opportunities(request: Request, limit: int = 10):
 
     try:
         opportunities = await market_analyzer.get_top_opportunities(limit=limit)
-        return opportunities
+        # Rows are already in MarketOpportunity shape - serialize them directly
+        return Response(content=orjson.dumps(opportunities), media_type="application/json")
     except Exception as e:
-        logger.error(f"Failed to get top opportunities: {str(e)}")
+        logger.error("Failed to get top opportunities: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to analyze markets: {str(e)}")
 
 
-@app.post("/analyze", response_model=AnalysisResult)
-async def analyze_market(request: AnalyzeRequest, http_request: Request, db: Session = Depends(get_db)):
-    """Analyze a market using Grok-4 with live search."""
-    settings = get_settings()
+def _persist_analysis_log(sources: List[str], **fields: Any) -> None:
+    """Write an AnalysisLog row using its own session (runs as a background task)."""
+    db = SessionLocal()
+    try:
+        db.add(AnalysisLog(sources=json.dumps(sources), **fields))
+        db.commit()
+    except Exception as e:
+        logger.error("Failed to persist analysis log for market %s: %s", fields.get("market_id"), e)
+    finally:
+        db.close()
 
-    # Rate limit using configurable settings
+
+def _check_analyze_rate_limit(http_request: Request, count: int = 1) -> None:
+    """
+    Apply the per-IP analysis rate limit shared by the /analyze endpoints,
+    charging `count` analyses at once - all of them or none.
+    """
     client_ip = get_client_ip(http_request)
-    if not check_rate_limit(client_ip, "analyze", max_requests=settings.rate_limit_analyze, window_seconds=60):
-        logger.warning(f"Rate limit exceeded for IP: {client_ip}")
+    if not check_rate_limit(client_ip, "analyze", max_requests=settings.rate_limit_analyze, window_seconds=RATE_LIMIT_WINDOW, cost=count):
+        logger.warning("Rate limit exceeded for IP: %s", client_ip)
         raise HTTPException(
             status_code=429,
             detail=f"Rate limit exceeded. Maximum {settings.rate_limit_analyze} analyses per minute. Please wait and try again."
         )
 
-    logger.info(f"Analyzing market: {request.market_id[:20]}... price={request.current_price:.2f}")
-    try:
-        # Convert portfolio context to dict if provided
-        portfolio_dict = None
-        if request.portfolio:
-            portfolio_dict = {
-                "balance": request.portfolio.balance,
-                "total_pnl": request.portfolio.total_pnl,
-                "active_trades": [
-                    {
-                        "market_id": t.market_id,
-                        "market_question": t.market_question,
-                        "direction": t.direction,
-                        "amount": t.amount,
-                        "entry_price": t.entry_price,
-                        "current_price": t.current_price,
-                        "pnl": t.pnl
-                    }
-                    for t in request.portfolio.active_trades
-                ]
-            }
-
-        # Run synchronous AI call in thread pool to avoid blocking the event loop
-        loop = asyncio.get_event_loop()
-        analyze_func = partial(
-            xai_service.analyze_market,
-            question=request.question,
-            current_price=request.current_price,
-            description=request.description,
-            end_date=request.end_date,
-            one_hour_change=request.one_hour_change,
-            one_day_change=request.one_day_change,
-            one_week_change=request.one_week_change,
-            one_month_change=request.one_month_change,
-            volume_24h=request.volume_24h,
-            volume_1w=request.volume_1w,
-            liquidity=request.liquidity,
-            spread=request.spread,
-            comment_count=request.comment_count,
-            competitive=request.competitive,
-            tags=request.tags,
-            days_until_resolution=request.days_until_resolution,
-            portfolio=portfolio_dict
-        )
-        result = await loop.run_in_executor(_executor, analyze_func)
 
-        edge = result["estimated_probability"] - request.current_price
-        logger.info(f"Analysis complete: prob={result['estimated_probability']:.2f}, edge={edge:+.2f}")
+def _analysis_inputs(request: AnalyzeRequest) -> Dict[str, Any]:
+    """Market fields from an analyze request, as xai_service keyword arguments."""
+    return dict(
+        question=request.question,
+        current_price=request.current_price,
+        description=request.description,
+        end_date=request.end_date,
+        one_hour_change=request.one_hour_change,
+        one_day_change=request.one_day_change,
+        one_week_change=request.one_week_change,
+        one_month_change=request.one_month_change,
+        volume_24h=request.volume_24h,
+        volume_1w=request.volume_1w,
+        liquidity=request.liquidity,
+        spread=request.spread,
+        comment_count=request.comment_count,
+        competitive=request.competitive,
+        tags=request.tags,
+        days_until_resolution=request.days_until_resolution,
+        portfolio=request.portfolio
+    )
+
+
+def _analysis_result(
+    request: AnalyzeRequest, result: Dict[str, Any], background_tasks: BackgroundTasks, persist: bool = True
+) -> AnalysisResult:
+    """
+    Build the API response for a finished analysis and, unless `persist` is
+    False (a cached answer that was already logged), queue its log write.
+    """
+    edge = result["estimated_probability"] - request.current_price
+    logger.info("Analysis complete: prob=%.2f, edge=%+.2f", result["estimated_probability"], edge)
 
-        # Log analysis
-        log = AnalysisLog(
+    # Log analysis after the response is sent - it's telemetry, not part of the result
+    if persist:
+        background_tasks.add_task(
+            _persist_analysis_log,
             market_id=request.market_id,
             market_question=request.question,
             market_price=request.current_price,
             ai_probability=result["estimated_probability"],
             edge=edge,
             reasoning=result["reasoning"],
-            sources=json.dumps(result.get("sources", []))
+            sources=result.get("sources", [])
         )
-        db.add(log)
-        db.commit()
 
-        # Build recommendation if present
-        recommendation = None
-        if result.get("recommendation"):
-            from .schemas import TradeRecommendation
-            rec = result["recommendation"]
-            recommendation = TradeRecommendation(
-                action=rec.get("action", "SKIP"),
-                amount=rec.get("amount"),
-                reasoning=rec.get("reasoning", ""),
-                risk_level=rec.get("risk_level", "medium"),
-                kelly_fraction=rec.get("kelly_fraction")
-            )
+    # The recommendation, if any, is already a validated TradeRecommendation
+    return AnalysisResult(
+        estimated_probability=result["estimated_probability"],
+        confidence=result.get("confidence", "medium"),
+        reasoning=result["reasoning"],
+        key_events=result.get("key_events", []),
+        risks=result.get("risks", []),
+        sources=result.get("sources", []),
+        edge=edge,
+        recommendation=result.get("recommendation")
+    )
 
-        return AnalysisResult(
-            estimated_probability=result["estimated_probability"],
-            confidence=result.get("confidence", "medium"),
-            reasoning=result["reasoning"],
-            key_events=result.get("key_events", []),
-            risks=result.get("risks", []),
-            sources=result.get("sources", []),
-            edge=edge,
-            recommendation=recommendation
-        )
+
+@app.post("/analyze", response_model=AnalysisResult)
+async def analyze_market(request: AnalyzeRequest, http_request: Request, background_tasks: BackgroundTasks):
+    """
+    Analyze a market using Grok-4 with live search. A recent answer for the
+    same inputs is reused unless the request asks to refresh.
+    """
+    from .services import xai_service
+
+    inputs = _analysis_inputs(request)
+
+    # A cached answer costs no xAI call, so it isn't rate limited or logged again
+    if not request.refresh:
+        cached = xai_service.analyze_market.cached(**inputs)
+        if cached is not None:
+            logger.info("Reusing cached analysis for market: %s...", request.market_id[:20])
+            return _analysis_result(request, cached, background_tasks, persist=False)
+
+    # Rate limit using configurable settings
+    _check_analyze_rate_limit(http_request)
+
+    logger.info("Analyzing market: %s... price=%.2f", request.market_id[:20], request.current_price)
+    try:
+        if request.refresh:
+            result = await xai_service.analyze_market.refresh(**inputs)
+        else:
+            result = await xai_service.analyze_market(**inputs)
+        return _analysis_result(request, result, background_tasks)
+    except Exception as e:
+        logger.error("Analysis failed for market %s: %s", request.market_id, e, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+
+
+@app.post("/analyze/stream")
+async def analyze_market_stream(request: AnalyzeRequest, http_request: Request):
+    """
+    Analyze a market like /analyze, streamed as server-sent events so the UI
+    can show the model's output as it arrives. "delta" events carry text as it
+    is generated, then a single "result" event carries the AnalysisResult
+    (or an "error" event carries the failure message).
+    """
+    from .services import xai_service
+
+    _check_analyze_rate_limit(http_request)
+
+    logger.info("Streaming analysis for market: %s... price=%.2f", request.market_id[:20], request.current_price)
+    background_tasks = BackgroundTasks()
+
+    async def events():
+        try:
+            async for event in xai_service.stream_market_analysis(**_analysis_inputs(request)):
+                if "delta" in event:
+                    yield b"event: delta\ndata: " + orjson.dumps(event["delta"]) + b"\n\n"
+                else:
+                    analysis = _analysis_result(request, event["result"], background_tasks)
+                    yield b"event: result\ndata: " + analysis.model_dump_json().encode() + b"\n\n"
+        except Exception as e:
+            logger.error("Streaming analysis failed for market %s: %s", request.market_id, e, exc_info=True)
+            yield b"event: error\ndata: " + orjson.dumps(f"Analysis failed: {str(e)}") + b"\n\n"
+
+    # The log write is queued once the result is known and runs after the stream ends
+    return StreamingResponse(events(), media_type="text/event-stream", background=background_tasks)
+
+
+@app.post("/analyze/batch", response_model=List[AnalysisResult])
+async def analyze_market_batch(request: AnalyzeBatchRequest, http_request: Request, background_tasks: BackgroundTasks):
+    """
+    Analyze several related markets. Markets with the same (non-empty) tags
+    are analyzed together in one xAI call, so the search is shared between
+    linked markets; untagged markets are analyzed one by one. Results come
+    back in request order; each group counts as one analysis against the
+    rate limit.
+    """
+    from .services import xai_service
+
+    # Market indices per xAI call, in request order. Untagged markets have
+    # nothing known in common, so each one goes on its own.
+    tagged: Dict[tuple, List[int]] = defaultdict(list)
+    groups: List[List[int]] = []
+    for index, market in enumerate(request.markets):
+        if market.tags:
+            tagged[tuple(market.tags)].append(index)
+        else:
+            groups.append([index])
+    groups.extend(tagged.values())
+    _check_analyze_rate_limit(http_request, len(groups))
+
+    # Markets the service has to analyze one by one cost extra xAI calls;
+    # they are counted after the fact, since the batch is already under way
+    client_ip = get_client_ip(http_request)
+
+    def count_extra_calls(count: int) -> None:
+        record_requests(client_ip, "analyze", count)
+
+    logger.info("Analyzing %d markets in %d groups", len(request.markets), len(groups))
+    try:
+        group_results = await asyncio.gather(*(
+            xai_service.analyze_markets_batch(
+                [_analysis_inputs(request.markets[i]) for i in indices], on_extra_calls=count_extra_calls
+            )
+            for indices in groups
+        ))
+        results: List[Optional[AnalysisResult]] = [None] * len(request.markets)
+        for indices, group in zip(groups, group_results):
+            for index, result in zip(indices, group):
+                results[index] = _analysis_result(request.markets[index], result, background_tasks)
+        return results
     except Exception as e:
-        logger.error(f"Analysis failed for market {request.market_id}: {str(e)}", exc_info=True)
+        logger.error("Batch analysis failed: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
 
 @app.post("/simulate-trade", response_model=TradeResponse)
 async def simulate_trade(request: SimulateTradeRequest, db: Session = Depends(get_db)):
     """Place a simulated trade."""
-    portfolio = db.query(Portfolio).first()
-    if not portfolio:
-        raise HTTPException(status_code=404, detail="Portfolio not found")
-
-    if request.amount <= 0:
-        raise HTTPException(status_code=400, detail="Amount must be positive")
-
-    if request.amount > portfolio.balance:
-        logger.warning(f"Insufficient balance: requested ${request.amount:.2f}, available ${portfolio.balance:.2f}")
+    # Bounds are checked by the schema; round to cents once here
+    amount = round(request.amount, 2)
+
+    # Deduct from balance in one guarded statement. The WHERE clause rejects
+    # overdrafts even under concurrent trades, and RETURNING gives the new balance.
+    # Only the one portfolio row is touched - the same row .first() loads elsewhere:
+    # UPDATE portfolio SET balance = balance - :amount
+    # WHERE id = (SELECT id FROM portfolio LIMIT 1) AND balance >= :amount RETURNING balance
+    new_balance = db.execute(
+        update(Portfolio)
+        .where(Portfolio.id == select(Portfolio.id).limit(1).scalar_subquery(), Portfolio.balance >= amount)
+        .values(balance=Portfolio.balance - amount)
+        .returning(Portfolio.balance)
+    ).scalar_one_or_none()
+
+    if new_balance is None:
+        # Nothing matched - work out why only on this (rare) path
+        row = db.query(Portfolio.balance).first()
+        if row is None:
+            raise HTTPException(status_code=404, detail="Portfolio not found")
+        logger.warning("Insufficient balance: requested $%.2f, available $%.2f", amount, row.balance)
         raise HTTPException(status_code=400, detail="Insufficient balance")
 
-    if request.direction not in ["YES", "NO"]:
-        raise HTTPException(status_code=400, detail="Direction must be YES or NO")
-
     # Create trade
     trade = Trade(
         market_id=request.market_id,
         market_question=request.market_question,
         direction=TradeDirection(request.direction),
-        amount=request.amount,
+        amount=amount,
         entry_price=request.price,
         current_price=request.price,
         status=TradeStatus.ACTIVE
     )
     db.add(trade)
 
-    # Deduct from balance using SQLAlchemy expression to prevent race conditions
-    # This generates: UPDATE portfolio SET balance = balance - :amount
-    portfolio.balance = Portfolio.balance - request.amount
+    # Flush so INSERT ... RETURNING fills in trade.id and created_at, and build
+    # the response before commit expires the instances (no refresh SELECTs)
+    db.flush()
+    # Values come straight from our own row, so skip validation
+    trade_info = TradeInfo.model_construct(
+        id=trade.id,
+        market_id=trade.market_id,
+        market_question=trade.market_question,
+        direction=trade.direction.value,
+        amount=trade.amount,
+        entry_price=trade.entry_price,
+        current_price=trade.current_price,
+        status=trade.status.value,
+        pnl=None,
+        created_at=trade.created_at
+    )
     db.commit()
-    db.refresh(portfolio)  # Get the updated value from DB
-    db.refresh(trade)
 
-    logger.info(f"Trade placed: ${request.amount:.2f} {request.direction} @ {request.price:.2f} | Balance: ${portfolio.balance:.2f}")
-    
+    logger.info(
+        "Trade placed: $%.2f %s @ %.2f | Balance: $%.2f",
+        amount, request.direction, request.price, new_balance
+    )
+
     return TradeResponse(
         success=True,
-        message=f"Placed ${request.amount:.2f} on {request.direction}",
-        trade=TradeInfo(
-            id=trade.id,
-            market_id=trade.market_id,
-            market_question=trade.market_question,
-            direction=trade.direction.value,
-            amount=trade.amount,
-            entry_price=trade.entry_price,
-            current_price=trade.current_price,
-            status=trade.status.value,
-            created_at=trade.created_at
-        ),
-        new_balance=portfolio.balance
+        message=f"Placed ${amount:.2f} on {request.direction}",
+        trade=trade_info,
+        new_balance=new_balance
     )
 
 
@@ -369,34 +521,29 @@ async def get_portfolio(db: Session = Depends(get_db)):
     if not portfolio:
         raise HTTPException(status_code=404, detail="Portfolio not found")
     
-    trades = db.query(Trade).filter(Trade.status == TradeStatus.ACTIVE).all()
+    trades = db.query(Trade).filter(Trade.status == TradeStatus.ACTIVE).order_by(Trade.id).all()
 
-    trade_infos = []
-    total_pnl = 0.0
-    for t in trades:
-        # Calculate theoretical PnL
-        if t.current_price and t.entry_price:
-            if t.direction == TradeDirection.YES:
-                pnl = (t.current_price - t.entry_price) * t.amount / t.entry_price
-            else:
-                pnl = (t.entry_price - t.current_price) * t.amount / t.entry_price
-        else:
-            pnl = 0.0
-        total_pnl += pnl
-        
-        trade_infos.append(TradeInfo(
+    # Total PnL is summed in SQL; the per-trade loop only builds the response rows
+    total_pnl = db.query(func.coalesce(func.sum(Trade.pnl), 0.0)).filter(
+        Trade.status == TradeStatus.ACTIVE
+    ).scalar()
+
+    # Rows are trusted DB values, so build the models without validation
+    trade_infos = [
+        TradeInfo.model_construct(
             id=t.id, market_id=t.market_id, market_question=t.market_question,
             direction=t.direction.value, amount=t.amount, entry_price=t.entry_price,
-            current_price=t.current_price, status=t.status.value, pnl=pnl, created_at=t.created_at
-        ))
-    
+            current_price=t.current_price, status=t.status.value, pnl=t.pnl, created_at=t.created_at
+        )
+        for t in trades
+    ]
+
     return PortfolioInfo(balance=portfolio.balance, active_trades=trade_infos, total_pnl=total_pnl)
 
 
 @app.post("/reset-portfolio", response_model=ResetResponse)
 async def reset_portfolio(db: Session = Depends(get_db)):
     """Reset portfolio to initial state."""
-    settings = get_settings()
     portfolio = db.query(Portfolio).first()
     if not portfolio:
         raise HTTPException(status_code=404, detail="Portfolio not found")
@@ -413,6 +560,8 @@ async def reset_portfolio(db: Session = Depends(get_db)):
 @app.post("/update-prices", response_model=PriceUpdateResponse)
 async def update_trade_prices(db: Session = Depends(get_db)):
     """Update current prices for all active trades using batch fetch."""
+    from .services import polymarket_service
+
     trades = db.query(Trade).filter(Trade.status == TradeStatus.ACTIVE).all()
 
     if not trades:
@@ -424,13 +573,13 @@ async def update_trade_prices(db: Session = Depends(get_db)):
 
     # Collect all unique market IDs and fetch in batch
     market_ids = list(set(trade.market_id for trade in trades))
-    logger.info(f"Updating prices for {len(trades)} trades across {len(market_ids)} markets")
+    logger.info("Updating prices for %d trades across %d markets", len(trades), len(market_ids))
 
     try:
         market_map = await polymarket_service.get_markets_batch(market_ids)
-        logger.info(f"Batch fetch returned {len(market_map)} markets")
+        logger.info("Batch fetch returned %d markets", len(market_map))
     except Exception as e:
-        logger.error(f"Batch market fetch failed: {e}")
+        logger.error("Batch market fetch failed: %s", e)
         return PriceUpdateResponse(
             success=False,
             updated_count=0,
@@ -449,7 +598,7 @@ async def update_trade_prices(db: Session = Depends(get_db)):
             missing_markets.append(trade.market_id[:20])
 
     if missing_markets:
-        logger.warning(f"Could not find prices for markets: {missing_markets}")
+        logger.warning("Could not find prices for markets: %s", missing_markets)
 
     db.commit()
     return PriceUpdateResponse(
@@ -462,15 +611,13 @@ async def update_trade_prices(db: Session = Depends(get_db)):
 @app.post("/calculate-return", response_model=CalculateReturnResponse)
 async def calculate_potential_return(request: CalculateReturnRequest):
     """Calculate potential return using Python's Decimal for precision."""
-    from decimal import Decimal, ROUND_HALF_UP
-
     # Use Decimal for precise financial calculations
     amount = Decimal(str(request.amount))
     price = Decimal(str(request.price))
 
     # Calculate shares and potential return with precision
-    shares = (amount / price).quantize(Decimal('0.000001'), rounding=ROUND_HALF_UP)
-    potential_return = shares.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    shares = (amount / price).quantize(_SHARES_QUANTUM, rounding=ROUND_HALF_UP)
+    potential_return = shares.quantize(_CENTS_QUANTUM, rounding=ROUND_HALF_UP)
 
     return CalculateReturnResponse(
         amount=float(amount),
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, Enum, Index
+from sqlalchemy import Column, Integer, String, Float, DateTime, Text, Enum, Index, and_, case
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.sql import func
 from .database import Base
 import enum
@@ -42,7 +43,33 @@ class Trade(Base):
     __table_args__ = (
         Index('idx_trade_status_market', 'status', 'market_id'),
         Index('idx_trade_created', 'created_at'),
+        # Covers the portfolio PnL aggregate so it never touches table rows
+        Index('idx_trade_active_pnl', 'status', 'direction', 'current_price', 'entry_price', 'amount'),
     )
+    # Fetch server defaults (created_at) via RETURNING on INSERT, not a later SELECT
+    __mapper_args__ = {"eager_defaults": True}
+
+    @hybrid_property
+    def pnl(self) -> float:
+        """Theoretical PnL at current_price (0.0 until both prices are known)."""
+        if not (self.current_price and self.entry_price):
+            return 0.0
+        if self.direction == TradeDirection.YES:
+            return (self.current_price - self.entry_price) * self.amount / self.entry_price
+        return (self.entry_price - self.current_price) * self.amount / self.entry_price
+
+    @pnl.inplace.expression
+    @classmethod
+    def _pnl_expression(cls):
+        """SQL form of pnl, so totals can be aggregated in the database."""
+        price_move = case(
+            (cls.direction == TradeDirection.YES, cls.current_price - cls.entry_price),
+            else_=cls.entry_price - cls.current_price,
+        )
+        return case(
+            (and_(cls.current_price != 0, cls.entry_price != 0), price_move * cls.amount / cls.entry_price),
+            else_=0.0,
+        )
 
 
 class AnalysisLog(Base):
@@ -1,28 +1,42 @@
-from pydantic import BaseModel, Field, field_validator
-from typing import Optional, List
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, ValidationInfo, ValidatorFunctionWrapHandler, field_validator
+from typing import Any, Dict, Literal, NotRequired, Optional, List
+from typing_extensions import TypedDict
 from datetime import datetime
 
 
+class BaseSchema(BaseModel):
+    """Base for all API schemas.
+
+    Validators/serializers are built on first use instead of at import time,
+    so models that only back rarely-hit endpoints don't slow down startup.
+    """
+    model_config = ConfigDict(defer_build=True)
+
+
 # Request schemas
-class ActiveTradeInfo(BaseModel):
+# The portfolio context is validated into plain dicts (TypedDicts) rather than
+# models: it is only read as a dict by xai_service, and a request can carry one
+# entry per open trade, so this skips a model instance per trade plus the copy
+# back to dict in the handler. Omitted optional keys are simply absent.
+class ActiveTradeInfo(TypedDict):
     """Simplified trade info for analysis context."""
     market_id: str
     market_question: str
-    direction: str
+    direction: Literal['YES', 'NO']
     amount: float
     entry_price: float
-    current_price: Optional[float] = None
-    pnl: Optional[float] = None
+    current_price: NotRequired[Optional[float]]
+    pnl: NotRequired[Optional[float]]
 
 
-class PortfolioContext(BaseModel):
+class PortfolioContext(TypedDict):
     """Portfolio context for trade recommendations."""
     balance: float
-    active_trades: List[ActiveTradeInfo] = []
-    total_pnl: float = 0.0
+    active_trades: NotRequired[List[ActiveTradeInfo]]
+    total_pnl: NotRequired[float]
 
 
-class AnalyzeRequest(BaseModel):
+class AnalyzeRequest(BaseSchema):
     market_id: str
     question: str
     description: Optional[str] = None
@@ -45,42 +59,58 @@ class AnalyzeRequest(BaseModel):
     days_until_resolution: Optional[int] = None
     # Portfolio context for trade recommendations
     portfolio: Optional[PortfolioContext] = None
+    # Skip any cached analysis and ask the model again (e.g. "Re-analyze")
+    refresh: bool = False
+
 
+class AnalyzeBatchRequest(BaseSchema):
+    """Related markets to analyze together; markets with the same tags share one AI call."""
+    markets: List[AnalyzeRequest] = Field(min_length=1, max_length=10)
 
-class SimulateTradeRequest(BaseModel):
+
+class SimulateTradeRequest(BaseSchema):
     market_id: str
     market_question: str
-    amount: float = Field(gt=0, le=1000000, description="Trade amount in USDC (max $1M)")
-    direction: str = Field(description="Trade direction: YES or NO")
+    amount: float = Field(ge=1, le=1000000, description="Trade amount in USDC (min $1, max $1M)")
+    direction: Literal['YES', 'NO'] = Field(description="Trade direction: YES or NO")
     price: float = Field(ge=0.0, le=1.0, description="Entry price (0.0 to 1.0)")
 
-    @field_validator('amount')
-    @classmethod
-    def validate_amount(cls, v: float) -> float:
-        if v < 1:
-            raise ValueError('Minimum trade amount is $1')
-        # Round to 2 decimal places
-        return round(v, 2)
-
-    @field_validator('direction')
-    @classmethod
-    def validate_direction(cls, v: str) -> str:
-        if v not in ['YES', 'NO']:
-            raise ValueError('Direction must be YES or NO')
-        return v
-
 
 # Response schemas
-class TradeRecommendation(BaseModel):
-    """AI-generated trade recommendation."""
-    action: str  # "BUY_YES", "BUY_NO", "HOLD", "SKIP"
+class TradeRecommendation(BaseSchema):
+    """AI-generated trade recommendation.
+
+    Validated straight from the model's JSON, so out-of-range values are
+    repaired rather than rejected: an unknown action becomes SKIP, an unknown
+    risk level becomes medium, a negative amount becomes 0 and the Kelly
+    fraction is clamped to [0, 1].
+    """
+    action: Literal['BUY_YES', 'BUY_NO', 'HOLD', 'SKIP'] = 'SKIP'
     amount: Optional[float] = None  # Recommended amount in USDC
-    reasoning: str  # Why this recommendation
-    risk_level: str  # "low", "medium", "high"
+    reasoning: str = ''  # Why this recommendation
+    risk_level: Literal['low', 'medium', 'high'] = 'medium'
     kelly_fraction: Optional[float] = None  # Optimal bet size as fraction of bankroll
 
+    @field_validator('action', 'risk_level', mode='wrap')
+    @classmethod
+    def _default_when_unknown(cls, value: Any, handler: ValidatorFunctionWrapHandler, info: ValidationInfo) -> str:
+        try:
+            return handler(value)
+        except ValidationError:
+            return cls.model_fields[info.field_name].default
+
+    @field_validator('amount')
+    @classmethod
+    def _non_negative(cls, value: Optional[float]) -> Optional[float]:
+        return None if value is None else max(0.0, value)
+
+    @field_validator('kelly_fraction')
+    @classmethod
+    def _fraction(cls, value: Optional[float]) -> Optional[float]:
+        return None if value is None else max(0.0, min(1.0, value))
+
 
-class AnalysisResult(BaseModel):
+class AnalysisResult(BaseSchema):
     estimated_probability: float
     confidence: str  # low, medium, high
     reasoning: str
@@ -91,7 +121,7 @@ class AnalysisResult(BaseModel):
     recommendation: Optional[TradeRecommendation] = None
 
 
-class MarketInfo(BaseModel):
+class MarketInfo(BaseSchema):
     id: str
     question: str
     description: Optional[str] = None
@@ -111,11 +141,39 @@ class MarketInfo(BaseModel):
     image: Optional[str] = None
 
 
-class TradeInfo(BaseModel):
+class MarketOpportunity(BaseSchema):
+    """
+    Row in the top-opportunities list. Carries what the scanner shows and what
+    /analyze needs, but not order book or media fields (see MarketInfo).
+    """
+    id: str
+    question: str
+    description: Optional[str] = None
+    yes_price: float
+    no_price: float
+    spread: Optional[float] = None
+    volume: Optional[float] = None
+    volume_24h: Optional[float] = None
+    volume_1w: Optional[float] = None
+    liquidity: Optional[float] = None
+    one_hour_change: Optional[float] = None
+    one_day_change: Optional[float] = None
+    one_week_change: Optional[float] = None
+    one_month_change: Optional[float] = None
+    competitive: Optional[float] = None
+    comment_count: Optional[int] = None
+    end_date: Optional[str] = None
+    days_until_resolution: Optional[int] = None
+    tags: List[str] = []
+    opportunity_score: float
+    score_breakdown: Dict[str, float]
+
+
+class TradeInfo(BaseSchema):
     id: int
     market_id: str
     market_question: str
-    direction: str
+    direction: Literal['YES', 'NO']
     amount: float
     entry_price: float
     current_price: Optional[float]
@@ -123,37 +181,34 @@ class TradeInfo(BaseModel):
     pnl: Optional[float] = None
     created_at: datetime
 
-    class Config:
-        from_attributes = True
-
 
-class PortfolioInfo(BaseModel):
+class PortfolioInfo(BaseSchema):
     balance: float
     active_trades: List[TradeInfo]
     total_pnl: float
 
 
-class TradeResponse(BaseModel):
+class TradeResponse(BaseSchema):
     success: bool
     message: str
     trade: Optional[TradeInfo] = None
     new_balance: float
 
 
-class ResetResponse(BaseModel):
+class ResetResponse(BaseSchema):
     """Response model for portfolio reset endpoint."""
     success: bool
     balance: float
     message: str
 
 
-class CalculateReturnRequest(BaseModel):
+class CalculateReturnRequest(BaseSchema):
     """Request model for calculating potential return."""
     amount: float = Field(gt=0)
     price: float = Field(gt=0, le=1.0)
 
 
-class CalculateReturnResponse(BaseModel):
+class CalculateReturnResponse(BaseSchema):
     """Response model for calculate return endpoint."""
     amount: float
     price: float
@@ -161,7 +216,7 @@ class CalculateReturnResponse(BaseModel):
     shares: float
 
 
-class PriceUpdateResponse(BaseModel):
+class PriceUpdateResponse(BaseSchema):
     """Response model for price update endpoint."""
     success: bool
     updated_count: int
@@ -5,51 +5,65 @@ Scores and ranks Polymarket markets to identify the best trading opportunities.
 Uses multiple factors: momentum, volume, liquidity, competitiveness, uncertainty, and timing.
 """
 
-import httpx
-import math
-from typing import List, Dict, Any
+import asyncio
+import heapq
+import orjson
+from bisect import bisect_right
+from math import log10
+from operator import mul
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, timezone
 
-GAMMA_API_URL = "https://gamma-api.polymarket.com"
+from ..cache import async_ttl_cache
+from .polymarket_service import UPSTREAM_CACHE_TTL, coerce_numbers, days_until, get_client
 
+# Events are requested in pages of this size, all issued at once
+EVENTS_PAGE_SIZE = 20
 
-def calculate_opportunity_score(market: Dict, event: Dict) -> Dict[str, Any]:
-    """
-    Calculate an opportunity score for a market based on multiple factors.
-    Returns the market data enriched with scoring information.
+# Timing score by days until resolution: <1 day is too soon, 1-7 is the sweet
+# spot, then tapering off. bisect_right picks the bucket in one C call.
+_TIMING_DAY_BOUNDS = (1, 7, 30, 90)
+_TIMING_SCORES = (30, 100, 80, 60, 40)
+
+# Numeric market fields the scorer reads, as (API key, default) pairs in the
+# order they are unpacked in calculate_opportunity_score
+_MARKET_NUMBERS = (
+    ("lastTradePrice", 0.5),
+    ("volume", 0.0),
+    ("volume24hr", 0.0),
+    ("volume1wk", 0.0),
+    ("spread", 0.05),
+    ("competitive", 0.0),
+    ("oneHourPriceChange", 0.0),
+    ("oneDayPriceChange", 0.0),
+    ("oneWeekPriceChange", 0.0),
+    ("oneMonthPriceChange", 0.0),
+)
+
+# Score components and their weights in the total, in matching order
+_SCORE_COMPONENTS = ("momentum", "volume", "liquidity", "spread", "uncertainty", "timing", "engagement")
+_SCORE_WEIGHTS = (0.25, 0.20, 0.15, 0.10, 0.15, 0.10, 0.05)
+
+
+def _score_components(
+    price: float,
+    volume_24h: float,
+    liquidity: float,
+    spread: float,
+    change_24h: float,
+    change_1w: float,
+    days_until_resolution: Optional[int],
+    comment_count: int,
+    is_featured: bool,
+) -> Tuple[float, ...]:
     """
-    
-    # Extract market data with defaults
-    price = float(market.get("lastTradePrice") or 0.5)
-    volume_24h = float(market.get("volume24hr") or 0)
-    volume_1w = float(market.get("volume1wk") or 0)
-    liquidity = float(market.get("liquidityNum") or market.get("liquidity") or 0)
-    spread = float(market.get("spread") or 0.05)
-    competitive = float(market.get("competitive") or 0)
-    
-    # Price changes
-    change_1h = float(market.get("oneHourPriceChange") or 0)
-    change_24h = float(market.get("oneDayPriceChange") or 0)
-    change_1w = float(market.get("oneWeekPriceChange") or 0)
-    change_1m = float(market.get("oneMonthPriceChange") or 0)
-    
-    # Event-level data
-    comment_count = int(event.get("commentCount") or 0)
-    is_featured = event.get("featured", False)
-    
-    # Parse end date for time-based scoring
-    end_date_str = market.get("endDate") or event.get("endDate")
-    days_until_resolution = None
-    if end_date_str:
-        try:
-            end_date = datetime.fromisoformat(end_date_str.replace("Z", "+00:00"))
-            now = datetime.now(timezone.utc)
-            days_until_resolution = max(0, (end_date - now).days)
-        except:
-            pass
+    Pure scoring math for one market, in _SCORE_COMPONENTS order.
 
+    Takes plain numbers only - no dict access, parsing or allocation beyond
+    the result tuple - so this is the one place to profile or optimize.
+    """
     # === SCORING COMPONENTS (0-100 each) ===
-    
+
     # 1. MOMENTUM SCORE (25%): Recent price movement indicates activity/news
     abs_change_24h = abs(change_24h)
     abs_change_1w = abs(change_1w)
@@ -57,10 +71,10 @@ def calculate_opportunity_score(market: Dict, event: Dict) -> Dict[str, Any]:
     
     # 2. VOLUME SCORE (20%): Higher volume = more interest & liquidity
     # Log scale since volume varies wildly
-    volume_score = min(100, math.log10(max(1, volume_24h)) * 15)
+    volume_score = min(100, log10(max(1, volume_24h)) * 15)
     
     # 3. LIQUIDITY SCORE (15%): Higher liquidity = easier to trade
-    liquidity_score = min(100, math.log10(max(1, liquidity)) * 15)
+    liquidity_score = min(100, log10(max(1, liquidity)) * 15)
     
     # 4. SPREAD SCORE (10%): Tighter spread = better execution
     # Invert: lower spread = higher score
@@ -73,44 +87,61 @@ def calculate_opportunity_score(market: Dict, event: Dict) -> Dict[str, Any]:
     # 6. TIMING SCORE (10%): Prefer markets resolving soon but not immediately
     timing_score = 50  # default
     if days_until_resolution is not None:
-        if days_until_resolution < 1:
-            timing_score = 30  # Too soon, risky
-        elif days_until_resolution < 7:
-            timing_score = 100  # Sweet spot
-        elif days_until_resolution < 30:
-            timing_score = 80
-        elif days_until_resolution < 90:
-            timing_score = 60
-        else:
-            timing_score = 40  # Too far out
+        timing_score = _TIMING_SCORES[bisect_right(_TIMING_DAY_BOUNDS, days_until_resolution)]
     
     # 7. ENGAGEMENT SCORE (5%): More comments = more interest
-    engagement_score = min(100, math.log10(max(1, comment_count)) * 30)
+    engagement_score = min(100, log10(max(1, comment_count)) * 30)
     if is_featured:
         engagement_score = min(100, engagement_score + 20)
     
-    # === WEIGHTED TOTAL SCORE ===
-    total_score = (
-        momentum_score * 0.25 +
-        volume_score * 0.20 +
-        liquidity_score * 0.15 +
-        spread_score * 0.10 +
-        uncertainty_score * 0.15 +
-        timing_score * 0.10 +
-        engagement_score * 0.05
+    return (
+        momentum_score, volume_score, liquidity_score, spread_score,
+        uncertainty_score, timing_score, engagement_score,
+    )
+
+
+def calculate_opportunity_score(market: Dict, event: Dict, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Calculate an opportunity score for a market based on multiple factors.
+    Returns the market data enriched with scoring information.
+
+    Pass `now` when scoring a batch so every market is measured against the same
+    clock reading instead of calling datetime.now() per market.
+    """
+    
+    # Extract market data with defaults
+    (
+        price, volume, volume_24h, volume_1w, spread, competitive,
+        change_1h, change_24h, change_1w, change_1m,
+    ) = coerce_numbers(market, _MARKET_NUMBERS)
+    liquidity = float(market.get("liquidityNum") or market.get("liquidity") or 0)
+    
+    # Event-level data
+    comment_count = int(event.get("commentCount") or 0)
+    is_featured = event.get("featured", False)
+    
+    # Parse end date for time-based scoring
+    end_date_str = market.get("endDate") or event.get("endDate")
+    if now is None:
+        now = datetime.now(timezone.utc)
+    days_until_resolution = days_until(end_date_str, now)
+
+    # Component scores (0-100 each), then their weighted total
+    scores = _score_components(
+        price, volume_24h, liquidity, spread, change_24h, change_1w,
+        days_until_resolution, comment_count, is_featured,
     )
+    total_score = sum(map(mul, scores, _SCORE_WEIGHTS))
     
-    # Build the enriched market object
+    # Build the enriched market object (shape of schemas.MarketOpportunity)
     return {
         "id": market.get("conditionId") or market.get("id") or "",
         "question": market.get("question") or event.get("title") or "Unknown",
         "description": market.get("description") or event.get("description") or "",
         "yes_price": price,
         "no_price": 1 - price,
-        "best_bid": float(market.get("bestBid")) if market.get("bestBid") else None,
-        "best_ask": float(market.get("bestAsk")) if market.get("bestAsk") else None,
         "spread": spread,
-        "volume": float(market.get("volume") or 0),
+        "volume": volume,
         "volume_24h": volume_24h,
         "volume_1w": volume_1w,
         "liquidity": liquidity,
@@ -120,25 +151,36 @@ def calculate_opportunity_score(market: Dict, event: Dict) -> Dict[str, Any]:
         "one_month_change": change_1m,
         "competitive": competitive,
         "comment_count": comment_count,
-        "is_featured": is_featured,
         "end_date": end_date_str,
         "days_until_resolution": days_until_resolution,
-        "image": market.get("image") or event.get("image"),
         "tags": [t.get("label") for t in event.get("tags", [])],
         # Scoring breakdown
         "opportunity_score": round(total_score, 1),
         "score_breakdown": {
-            "momentum": round(momentum_score, 1),
-            "volume": round(volume_score, 1),
-            "liquidity": round(liquidity_score, 1),
-            "spread": round(spread_score, 1),
-            "uncertainty": round(uncertainty_score, 1),
-            "timing": round(timing_score, 1),
-            "engagement": round(engagement_score, 1),
+            name: round(score, 1) for name, score in zip(_SCORE_COMPONENTS, scores)
         }
     }
 
 
+async def _fetch_events_page(offset: int, limit: int) -> List[Dict[str, Any]]:
+    """Fetch one page of active events, ordered by 24h volume."""
+    client = get_client()
+    response = await client.get(
+        "/events",
+        params={
+            "active": "true",
+            "closed": "false",
+            "limit": limit,
+            "offset": offset,
+            "order": "volume24hr",
+            "ascending": "false"
+        }
+    )
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
+
+@async_ttl_cache(ttl=UPSTREAM_CACHE_TTL)
 async def get_top_opportunities(limit: int = 10, fetch_limit: int = 100) -> List[Dict[str, Any]]:
     """
     Fetch markets from Polymarket, analyze them, and return the top opportunities.
@@ -148,33 +190,37 @@ async def get_top_opportunities(limit: int = 10, fetch_limit: int = 100) -> List
         fetch_limit: Number of markets to fetch and analyze
 
     Returns:
-        List of top markets sorted by opportunity score
+        List of top markets sorted by opportunity score (cached briefly and
+        shared between callers, so treat it as read-only)
     """
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        # Fetch active events with full data
-        response = await client.get(
-            f"{GAMMA_API_URL}/events",
-            params={
-                "active": "true",
-                "closed": "false",
-                "limit": fetch_limit,
-                "order": "volume24hr",
-                "ascending": "false"
-            }
-        )
-        response.raise_for_status()
-        events = response.json()
+    # Fetch active events with full data, one request per page, concurrently
+    pages = await asyncio.gather(*(
+        _fetch_events_page(offset, min(EVENTS_PAGE_SIZE, fetch_limit - offset))
+        for offset in range(0, fetch_limit, EVENTS_PAGE_SIZE)
+    ))
+
+    # Volume ranks can shift between page requests, so the same event may show
+    # up on two pages - keep only its first copy
+    events = []
+    seen_event_ids = set()
+    for page in pages:
+        for event in page:
+            event_id = event.get("id")
+            if event_id is not None:
+                if event_id in seen_event_ids:
+                    continue
+                seen_event_ids.add(event_id)
+            events.append(event)
 
     # Analyze all markets
-    analyzed_markets = []
-    for event in events:
-        event_markets = event.get("markets", [])
-        for market in event_markets:
-            if market.get("active", True) and market.get("acceptingOrders", True):
-                analyzed = calculate_opportunity_score(market, event)
-                analyzed_markets.append(analyzed)
-
-    # Sort by opportunity score (descending) and return top N
-    analyzed_markets.sort(key=lambda x: x["opportunity_score"], reverse=True)
-    return analyzed_markets[:limit]
+    now = datetime.now(timezone.utc)
+    analyzed_markets = [
+        calculate_opportunity_score(market, event, now)
+        for event in events
+        for market in event.get("markets", ())
+        if market.get("active", True) and market.get("acceptingOrders", True)
+    ]
+
+    # Top N by opportunity score (descending) - a bounded heap, not a full sort
+    return heapq.nlargest(limit, analyzed_markets, key=lambda x: x["opportunity_score"])
 
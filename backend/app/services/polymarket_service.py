@@ -1,205 +1,384 @@
+import asyncio
 import httpx
-import json
-from typing import List, Dict, Any, Optional
+import orjson
+import re
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Set, Tuple
+from ..cache import async_ttl_cache
 
 GAMMA_API_URL = "https://gamma-api.polymarket.com"
 
 # Default limit increased to fetch more markets
 DEFAULT_MARKET_LIMIT = 100
 
+# How long market listings are reused before asking the Gamma API again.
+# Short enough to stay fresh, long enough to fold request bursts into one call.
+UPSTREAM_CACHE_TTL = 5.0
+
+# Max concurrent per-market lookups when the events scan misses some IDs
+MARKET_LOOKUP_CONCURRENCY = 10
+
+# Numeric market fields _parse_market copies through as floats, as (Gamma API
+# key, default) pairs in the order they are unpacked there; missing, null or
+# empty values become 0.0
+_MARKET_FLOAT_FIELDS = (
+    ("volume", 0.0),
+    ("volume24hr", 0.0),
+    ("volume1wk", 0.0),
+    ("liquidity", 0.0),
+    ("spread", 0.0),
+    ("oneHourPriceChange", 0.0),
+    ("oneDayPriceChange", 0.0),
+    ("oneWeekPriceChange", 0.0),
+    ("oneMonthPriceChange", 0.0),
+    ("competitive", 0.0),
+)
+
+# Cheap pre-filter so obviously malformed end dates skip fromisoformat entirely;
+# date-only values still pass through to it
+_ISO_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+# One client for the whole process so TLS sessions and keep-alive connections
+# to the Gamma API are reused instead of renegotiated on every call. HTTP/2 lets
+# concurrent requests (paged scans, batch lookups) share a single connection.
+# httpx advertises every decoder it has installed, so with the brotli extra the
+# mostly-repeated-keys events JSON comes back as br instead of gzip.
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared Gamma API client, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=GAMMA_API_URL,
+            http2=True,
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared client (called on app shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def coerce_numbers(source: Dict, fields: Tuple[Tuple[str, float], ...]) -> List[float]:
+    """
+    Read each (key, default) pair from source as a float in one pass. Missing,
+    null, empty or zero values take the default, same as float(x or default).
+    """
+    get = source.get
+    return [float(get(key) or default) for key, default in fields]
+
+
+@lru_cache(maxsize=4096)
+def parse_end_date(value: str) -> Optional[datetime]:
+    """
+    Parse a Gamma ISO timestamp or date-only value into an aware datetime
+    (naive means UTC, a bare date means midnight UTC), or None if it is
+    malformed. Cached because markets in one event share an end
+    date and the same dates come back on every poll.
+    """
+    if not _ISO_RE.match(value):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        # Right shape but not a real date (e.g. month 13)
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def days_until(end_date: Optional[str], now: datetime) -> Optional[int]:
+    """Whole days from `now` (aware) until end_date, floored at 0; None if unknown."""
+    if not end_date:
+        return None
+    end_dt = parse_end_date(end_date)
+    if end_dt is None:
+        return None
+    return max(0, (end_dt - now).days)
+
 
 def parse_outcome_prices(outcome_prices_raw) -> tuple:
     """Parse outcome prices which can be a JSON string or list."""
     try:
-        # If it's a string (JSON encoded), parse it
+        # If it's a string (JSON encoded), parse it - only an array can hold
+        # prices, so anything else skips the decode (and its exception) entirely
         if isinstance(outcome_prices_raw, str):
-            outcome_prices = json.loads(outcome_prices_raw)
+            if not outcome_prices_raw.lstrip().startswith("["):
+                return 0.5, 0.5
+            outcome_prices = orjson.loads(outcome_prices_raw)
         else:
             outcome_prices = outcome_prices_raw or []
 
-        if outcome_prices and len(outcome_prices) >= 1:
+        # The usual ["yes", "no"] pair, without the length branching below
+        if len(outcome_prices) == 2:
+            return float(outcome_prices[0]), float(outcome_prices[1])
+        if outcome_prices:
             yes_price = float(outcome_prices[0])
             no_price = float(outcome_prices[1]) if len(outcome_prices) > 1 else 1 - yes_price
             return yes_price, no_price
-    except (ValueError, IndexError, json.JSONDecodeError):
+    except (ValueError, IndexError, orjson.JSONDecodeError):
         pass
     return 0.5, 0.5
 
 
-def _parse_market(market: Dict, event: Dict) -> Dict[str, Any]:
-    """Parse a market dict into our standard format."""
-    # Get all possible price sources
-    best_bid = market.get("bestBid")
-    best_ask = market.get("bestAsk")
-    last_trade = market.get("lastTradePrice")
-    outcome_prices_raw = market.get("outcomePrices")
-
+def _select_yes_price(
+    last_trade: Optional[float],
+    best_bid: Optional[float],
+    best_ask: Optional[float],
+    outcome_prices_raw: Any,
+) -> float:
+    """Pick the best available YES price and clamp it to [0.001, 0.999]."""
     # Priority 1: Use lastTradePrice if available (most accurate)
     if last_trade is not None:
-        yes_price = float(last_trade)
-        no_price = 1 - yes_price
+        yes_price = last_trade
     # Priority 2: Use mid of bestBid/bestAsk
     elif best_bid is not None and best_ask is not None:
-        yes_price = (float(best_bid) + float(best_ask)) / 2
-        no_price = 1 - yes_price
+        yes_price = (best_bid + best_ask) / 2
     # Priority 3: Parse outcomePrices
     elif outcome_prices_raw:
-        yes_price, no_price = parse_outcome_prices(outcome_prices_raw)
+        yes_price = parse_outcome_prices(outcome_prices_raw)[0]
     # Fallback
     else:
-        yes_price, no_price = 0.5, 0.5
+        return 0.5
+
+    # Ensure valid probability range.
+    # Comparisons rather than max(min()) - no builtin calls per market.
+    if yes_price < 0.001:
+        return 0.001
+    if yes_price > 0.999:
+        return 0.999
+    return yes_price
+
+
+def _event_fields(event: Dict) -> Tuple:
+    """
+    Read the event-level fields every market in the event falls back to or
+    inherits, once per event: (title, description, end date, comment count,
+    tags, featured, image).
+    """
+    get = event.get
+    return (
+        get("title"),
+        get("description"),
+        get("endDate"),
+        int(get("commentCount") or 0),
+        get("tags") or [],
+        get("featured", False),
+        get("image"),
+    )
+
+
+def _parse_market(market: Dict, event_fields: Tuple, now: datetime) -> Dict[str, Any]:
+    """
+    Parse a market dict into our standard format. `event_fields` comes from
+    _event_fields on the parent event; `now` is the batch's clock reading.
+    """
+    (
+        event_title, event_description, event_end_date,
+        comment_count, tags, featured, event_image,
+    ) = event_fields
+
+    # Bound once - this function does a dozen-plus lookups per market
+    get = market.get
+
+    # Get all possible price sources, converted once for both the ladder and the output
+    best_bid = get("bestBid")
+    best_ask = get("bestAsk")
+    last_trade = get("lastTradePrice")
+    outcome_prices_raw = get("outcomePrices")
+    if best_bid is not None:
+        best_bid = float(best_bid)
+    if best_ask is not None:
+        best_ask = float(best_ask)
+    if last_trade is not None:
+        last_trade = float(last_trade)
 
-    # Ensure valid probability range
-    yes_price = max(0.001, min(0.999, yes_price))
+    # NO is always derived from the clamped YES
+    yes_price = _select_yes_price(last_trade, best_bid, best_ask, outcome_prices_raw)
     no_price = 1 - yes_price
 
     # Calculate days until resolution
-    end_date = market.get("endDate") or event.get("endDate")
-    days_until = None
-    if end_date:
-        try:
-            from datetime import datetime
-            end_dt = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-            now = datetime.now(end_dt.tzinfo)
-            days_until = max(0, (end_dt - now).days)
-        except:
-            pass
+    end_date = get("endDate") or event_end_date
+
+    # Volume, liquidity, spread, momentum and competitiveness in one pass
+    (
+        volume, volume_24h, volume_1w, liquidity, spread,
+        change_1h, change_24h, change_1w, change_1m, competitive,
+    ) = coerce_numbers(market, _MARKET_FLOAT_FIELDS)
 
+    # One literal with every key, so the dict is built in a single step
+    # rather than grown through successive updates
     return {
-        "id": market.get("conditionId") or market.get("id") or "",
-        "question": market.get("question") or event.get("title") or "Unknown",
-        "description": market.get("description") or event.get("description") or "",
+        "id": get("conditionId") or get("id") or "",
+        "question": get("question") or event_title or "Unknown",
+        "description": get("description") or event_description or "",
         "yes_price": yes_price,
         "no_price": no_price,
-        "best_bid": float(best_bid) if best_bid is not None else None,
-        "best_ask": float(best_ask) if best_ask is not None else None,
-        "last_trade_price": float(last_trade) if last_trade is not None else None,
-        "volume": float(market.get("volume") or 0),
-        "volume_24h": float(market.get("volume24hr") or 0),
-        "volume_1w": float(market.get("volume1wk") or 0),
-        "liquidity": float(market.get("liquidity") or 0),
-        "spread": float(market.get("spread") or 0),
+        "best_bid": best_bid,
+        "best_ask": best_ask,
+        "last_trade_price": last_trade,
+        "volume": volume,
+        "volume_24h": volume_24h,
+        "volume_1w": volume_1w,
+        "liquidity": liquidity,
+        "spread": spread,
         # Price momentum
-        "one_hour_change": float(market.get("oneHourPriceChange") or 0),
-        "one_day_change": float(market.get("oneDayPriceChange") or 0),
-        "one_week_change": float(market.get("oneWeekPriceChange") or 0),
-        "one_month_change": float(market.get("oneMonthPriceChange") or 0),
+        "one_hour_change": change_1h,
+        "one_day_change": change_24h,
+        "one_week_change": change_1w,
+        "one_month_change": change_1m,
+        "competitive": competitive,
         # Engagement & metadata
-        "competitive": float(market.get("competitive") or 0),
-        "comment_count": int(event.get("commentCount") or 0),
-        "tags": event.get("tags") or [],
-        "featured": event.get("featured", False),
+        "comment_count": comment_count,
+        "tags": tags,
+        "featured": featured,
         # Timing
         "end_date": end_date,
-        "days_until_resolution": days_until,
-        "image": market.get("image") or event.get("image")
+        "days_until_resolution": days_until(end_date, now),
+        "image": get("image") or event_image
     }
 
 
-async def fetch_active_markets(limit: int = DEFAULT_MARKET_LIMIT) -> List[Dict[str, Any]]:
-    """
-    Fetch active markets from Polymarket Gamma API.
-    Returns a list of markets with their current prices.
-    """
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        # Fetch active events
-        response = await client.get(
-            f"{GAMMA_API_URL}/events",
-            params={
-                "active": "true",
-                "closed": "false",
-                "limit": limit,
-                "order": "volume24hr",
-                "ascending": "false"
-            }
-        )
-        response.raise_for_status()
-        events = response.json()
-
+def _parse_events(events: List[Dict]) -> List[Dict[str, Any]]:
+    """Parse the active markets of each event, reading event fields once per event."""
+    # Each event can have multiple markets (outcomes); only include active ones
+    now = datetime.now(timezone.utc)
     markets = []
     for event in events:
-        # Each event can have multiple markets (outcomes)
-        event_markets = event.get("markets", [])
-        for market in event_markets:
-            # Only include active markets
-            if market.get("active", True):
-                markets.append(_parse_market(market, event))
-
+        event_fields = _event_fields(event)
+        markets.extend(
+            _parse_market(market, event_fields, now)
+            for market in event.get("markets", ())
+            if market.get("active", True)
+        )
     return markets
 
 
+@async_ttl_cache(ttl=UPSTREAM_CACHE_TTL)
+async def fetch_active_markets(limit: int = DEFAULT_MARKET_LIMIT) -> List[Dict[str, Any]]:
+    """
+    Fetch active markets from Polymarket Gamma API.
+    Returns a list of markets with their current prices. Results are cached
+    briefly and shared between callers, so treat them as read-only.
+    """
+    client = get_client()
+    # Fetch active events
+    response = await client.get(
+        "/events",
+        params={
+            "active": "true",
+            "closed": "false",
+            "limit": limit,
+            "order": "volume24hr",
+            "ascending": "false"
+        }
+    )
+    response.raise_for_status()
+    events = orjson.loads(response.content)
+
+    return _parse_events(events)
+
+
+@async_ttl_cache(ttl=UPSTREAM_CACHE_TTL)
 async def search_markets(query: str, limit: int = 50) -> List[Dict[str, Any]]:
     """
     Search for markets by keyword in title/question.
     Uses the Gamma API's title_contains parameter for server-side filtering.
+    Results are cached briefly per (query, limit), so treat them as read-only.
     """
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        # Search events by title
-        response = await client.get(
-            f"{GAMMA_API_URL}/events",
-            params={
-                "active": "true",
-                "closed": "false",
-                "limit": limit,
-                "title_contains": query,
-                "order": "volume24hr",
-                "ascending": "false"
-            }
-        )
-        response.raise_for_status()
-        events = response.json()
-
-    markets = []
-    for event in events:
-        event_markets = event.get("markets", [])
-        for market in event_markets:
-            if market.get("active", True):
-                markets.append(_parse_market(market, event))
-
-    return markets
+    client = get_client()
+    # Search events by title
+    response = await client.get(
+        "/events",
+        params={
+            "active": "true",
+            "closed": "false",
+            "limit": limit,
+            "title_contains": query,
+            "order": "volume24hr",
+            "ascending": "false"
+        }
+    )
+    response.raise_for_status()
+    events = orjson.loads(response.content)
+
+    return _parse_events(events)
 
 
 async def get_market_by_id(market_id: str) -> Optional[Dict[str, Any]]:
     """Fetch a specific market by its condition ID."""
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        # Try fetching by condition_id with slug filter to get exact match
+    client = get_client()
+    # Try fetching by condition_id with slug filter to get exact match
+    response = await client.get(
+        f"/markets/{market_id}"
+    )
+
+    # If direct fetch fails, try the query endpoint
+    if response.status_code != 200:
         response = await client.get(
-            f"{GAMMA_API_URL}/markets/{market_id}"
+            "/markets",
+            params={"condition_id": market_id}
         )
 
-        # If direct fetch fails, try the query endpoint
-        if response.status_code != 200:
-            response = await client.get(
-                f"{GAMMA_API_URL}/markets",
-                params={"condition_id": market_id}
-            )
-
-        if response.status_code == 200:
-            data = response.json()
-            # Handle both single market and list response
-            if isinstance(data, list):
-                # Find the matching market by conditionId
-                for market in data:
-                    if market.get("conditionId") == market_id:
-                        outcome_prices_raw = market.get("outcomePrices", "[\"0.5\", \"0.5\"]")
-                        yes_price, no_price = parse_outcome_prices(outcome_prices_raw)
-                        return {
-                            "id": market.get("conditionId", ""),
-                            "question": market.get("question", ""),
-                            "yes_price": yes_price,
-                            "no_price": no_price
-                        }
-            elif isinstance(data, dict):
-                market = data
+    if response.status_code == 200:
+        data = orjson.loads(response.content)
+        # Handle both single market and list response
+        if isinstance(data, list):
+            # Find the matching market by conditionId
+            for market in data:
+                if market.get("conditionId") == market_id:
+                    outcome_prices_raw = market.get("outcomePrices", "[\"0.5\", \"0.5\"]")
+                    yes_price, no_price = parse_outcome_prices(outcome_prices_raw)
+                    return {
+                        "id": market.get("conditionId", ""),
+                        "question": market.get("question", ""),
+                        "yes_price": yes_price,
+                        "no_price": no_price
+                    }
+        elif isinstance(data, dict):
+            market = data
+            outcome_prices_raw = market.get("outcomePrices", "[\"0.5\", \"0.5\"]")
+            yes_price, no_price = parse_outcome_prices(outcome_prices_raw)
+            return {
+                "id": market.get("conditionId", ""),
+                "question": market.get("question", ""),
+                "yes_price": yes_price,
+                "no_price": no_price
+            }
+    return None
+
+
+def _collect_batch_prices(events: List[Dict], wanted: Set[str], market_map: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Add a price entry to market_map for each market in `wanted` found in
+    `events`, removing it from `wanted` as it goes. Stops scanning as soon as
+    nothing is left to find.
+    """
+    for event in events:
+        for market in event.get("markets", ()):
+            condition_id = market.get("conditionId", "")
+            if condition_id in wanted:
                 outcome_prices_raw = market.get("outcomePrices", "[\"0.5\", \"0.5\"]")
                 yes_price, no_price = parse_outcome_prices(outcome_prices_raw)
-                return {
-                    "id": market.get("conditionId", ""),
+                market_map[condition_id] = {
+                    "id": condition_id,
                     "question": market.get("question", ""),
                     "yes_price": yes_price,
                     "no_price": no_price
                 }
-    return None
+                wanted.discard(condition_id)
+                if not wanted:
+                    return
 
 
 async def get_markets_batch(market_ids: List[str]) -> Dict[str, Dict[str, Any]]:
@@ -215,74 +394,80 @@ async def get_markets_batch(market_ids: List[str]) -> Dict[str, Dict[str, Any]]:
         return {}
 
     market_map = {}
-    market_id_set = set(market_ids)
-
-    # Fetch from events endpoint (same as scanner) - this has full conditionIds
-    async with httpx.AsyncClient(timeout=60.0) as client:
+    market_id_set = frozenset(market_ids)
+    # Shrinks as markets are found, so each later stage only looks for the rest
+    missing_ids = set(market_id_set)
+
+    # Fetch from events endpoint (same as scanner) - this has full conditionIds.
+    # The closed-events fallback is requested at the same time so a miss doesn't
+    # cost a second round trip; it is cancelled if the active scan finds everything.
+    client = get_client()
+    closed_request = asyncio.ensure_future(client.get(
+        "/events",
+        params={
+            "closed": "true",
+            "limit": 100,
+            "order": "endDate",
+            "ascending": "false"
+        },
+        timeout=60.0
+    ))
+    try:
         response = await client.get(
-            f"{GAMMA_API_URL}/events",
+            "/events",
             params={
                 "active": "true",
                 "closed": "false",
                 "limit": 200,  # Fetch many events
                 "order": "volume24hr",
                 "ascending": "false"
-            }
+            },
+            timeout=60.0
         )
         if response.status_code != 200:
             logger.error(f"Events fetch failed with status {response.status_code}")
             return {}
 
-        events = response.json()
+        events = orjson.loads(response.content)
         logger.info(f"Fetched {len(events)} events from Polymarket")
 
-        # Extract all markets from events
-        for event in events:
-            for market in event.get("markets", []):
-                condition_id = market.get("conditionId", "")
-                if condition_id in market_id_set:
-                    outcome_prices_raw = market.get("outcomePrices", "[\"0.5\", \"0.5\"]")
-                    yes_price, no_price = parse_outcome_prices(outcome_prices_raw)
-                    market_map[condition_id] = {
-                        "id": condition_id,
-                        "question": market.get("question", ""),
-                        "yes_price": yes_price,
-                        "no_price": no_price
-                    }
+        # Extract the requested markets from events
+        _collect_batch_prices(events, missing_ids, market_map)
 
-    logger.info(f"Found {len(market_map)} matches in events, {len(market_id_set) - len(market_map)} missing")
+        logger.info(f"Found {len(market_map)} matches in events, {len(missing_ids)} missing")
 
-    # For any missing markets, try fetching more events or closed markets
-    missing_ids = market_id_set - set(market_map.keys())
-    if missing_ids:
-        logger.info(f"Trying to fetch {len(missing_ids)} missing markets from closed events...")
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            # Try closed events too
-            response = await client.get(
-                f"{GAMMA_API_URL}/events",
-                params={
-                    "closed": "true",
-                    "limit": 100,
-                    "order": "endDate",
-                    "ascending": "false"
-                }
-            )
+        # For any missing markets, try fetching more events or closed markets
+        if missing_ids:
+            logger.info(f"Checking closed events for {len(missing_ids)} missing markets...")
+            # Try closed events too (already in flight)
+            response = await closed_request
             if response.status_code == 200:
-                events = response.json()
-                for event in events:
-                    for market in event.get("markets", []):
-                        condition_id = market.get("conditionId", "")
-                        if condition_id in missing_ids:
-                            outcome_prices_raw = market.get("outcomePrices", "[\"0.5\", \"0.5\"]")
-                            yes_price, no_price = parse_outcome_prices(outcome_prices_raw)
-                            market_map[condition_id] = {
-                                "id": condition_id,
-                                "question": market.get("question", ""),
-                                "yes_price": yes_price,
-                                "no_price": no_price
-                            }
-
-    final_missing = market_id_set - set(market_map.keys())
+                _collect_batch_prices(orjson.loads(response.content), missing_ids, market_map)
+    finally:
+        # However the above ends, don't leave the closed-events request running
+        # or its failure unretrieved
+        if not closed_request.done():
+            closed_request.cancel()
+        elif not closed_request.cancelled():
+            closed_request.exception()
+
+    # Look up whatever is still missing one market at a time, issued concurrently
+    missing_ids = list(missing_ids)
+    if missing_ids:
+        semaphore = asyncio.Semaphore(MARKET_LOOKUP_CONCURRENCY)
+
+        async def lookup(market_id: str) -> Optional[Dict[str, Any]]:
+            async with semaphore:
+                return await get_market_by_id(market_id)
+
+        results = await asyncio.gather(*(lookup(m) for m in missing_ids), return_exceptions=True)
+        for market_id, market in zip(missing_ids, results):
+            if isinstance(market, Exception):
+                logger.warning(f"Lookup failed for market {market_id[:20]}: {market}")
+            elif market:
+                market_map[market_id] = market
+
+    final_missing = market_id_set - market_map.keys()
     if final_missing:
         logger.warning(f"Could not find {len(final_missing)} markets: {[m[:20] for m in final_missing]}")
 
@@ -1,14 +1,211 @@
-import json
-import re
+import asyncio
+import hashlib
+import inspect
+import orjson
+import time
+from collections import deque
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List
-from xai_sdk import Client
-from xai_sdk.chat import user
+from itertools import chain
+from typing import AsyncIterator, Callable, Deque, Dict, Any, Optional, List, Tuple
+from xai_sdk import AsyncClient
+from xai_sdk.aio.chat import Chat
+from xai_sdk.chat import system, user
 from xai_sdk.tools import web_search, x_search
+from ..cache import async_ttl_cache
 from ..config import get_settings
+from ..schemas import TradeRecommendation
+
+# How long an analysis is reused for the same (bucketed) market inputs
+ANALYSIS_CACHE_TTL = 300.0
+
+# Market inputs that drift between polls, bucketed in the cache key so trivial
+# moves still hit: prices to 1 point, momentum to half a point, and volume and
+# liquidity to two significant figures
+_CACHE_PRICE_FIELDS = ("current_price", "spread", "competitive")
+_CACHE_MOMENTUM_FIELDS = ("one_hour_change", "one_day_change", "one_week_change", "one_month_change")
+_CACHE_SIZE_FIELDS = ("volume_24h", "volume_1w", "liquidity")
+
+# Context labels for the momentum windows (one_hour_change .. one_month_change)
+# and for volume_24h, volume_1w and liquidity, in argument order
+_MOMENTUM_LABELS = ("1h", "24h", "7d", "30d")
+_SIZE_LABELS = ("24H TRADING VOLUME", "7D TRADING VOLUME", "MARKET LIQUIDITY")
+
+# The analysis instructions, sent as the system message. The text is the same
+# byte for byte on every call (there's no per-market or portfolio variant), so
+# the provider can reuse its cached prefix; the market itself follows in the
+# user message.
+_SYSTEM_PROMPT = """You are an expert prediction market analyst and portfolio manager. Estimate the probability that the market in the user message resolves YES and, when a PORTFOLIO STATUS section is given, recommend a trade.
+
+RESEARCH:
+1. Search the web and X for current news, data, expert opinion, real-time sentiment and breaking news - issue independent searches together in one turn so they run concurrently
+2. Search "Polymarket" plus the market question for community discussion - traders often post obscure rules, debunking evidence or resolution details
+3. Use images and charts in results (polls, screenshots of official statements)
+4. Check the resolution criteria and price momentum - recent moves may mean new information
+5. Red-team your thesis: actively look for evidence that you are wrong
+
+Respond with only this JSON object:
+{
+    "estimated_probability": <float 0.0-1.0>,
+    "confidence": "<low|medium|high>",
+    "reasoning": "<multi-paragraph analysis, line breaks between sections>",
+    "key_events": ["<upcoming event/date>", ...],
+    "risks": ["<risk to your thesis>", ...],
+    "sources": ["<url>", ...],
+    "recommendation": {
+        "action": "<BUY_YES|BUY_NO|HOLD|SKIP>",
+        "amount": <USDC amount, or null for SKIP/HOLD>,
+        "reasoning": "<why this trade>",
+        "risk_level": "<low|medium|high>",
+        "kelly_fraction": <bet size as a fraction 0.0-1.0>
+    }
+}
+Omit "recommendation" unless a PORTFOLIO STATUS section is given.
+
+RULES:
+- Be precise - don't default to 50%. Explain large price moves. Use "high" confidence only for strong, recent evidence
+- Markets below 20% or above 80% likely know something you don't; contradict 5%/95% prices only with smoking-gun evidence
+- BUY_YES if your probability > price, BUY_NO if < price, HOLD to keep an existing position, SKIP if edge < 5%, confidence is low or risk is high
+- Size with fractional Kelly (~25%), never over 10% of balance; go smaller under a $50 balance and don't double down on existing positions"""
+
+# Batch analyses share the single-market prompt as a prefix, so the provider's
+# cached prefix covers both; only the answer shape changes
+_BATCH_SYSTEM_PROMPT = _SYSTEM_PROMPT + """
+
+BATCH:
+The user message lists several related markets as numbered sections. Research them together, sharing evidence between markets, and keep your estimates consistent with each other.
+Respond with only {"analyses": [...]}, one object of the shape above per market, in section order. Apply the recommendation rule to each section separately."""
+
+
+# One SDK client per process, so its connection pool is reused across analyses
+_client: Optional[AsyncClient] = None
+
+# Outbound throttling shared by every analysis: a cap on requests in flight
+# (created on first use) and the start times of requests in the last minute
+_request_semaphore: Optional[asyncio.Semaphore] = None
+_request_starts: Deque[float] = deque()
+
+# Web search takes the same options on every call, so the tool is built once;
+# x_search is rebuilt per call because its from_date follows the lookback window
+_WEB_SEARCH_TOOL = web_search(enable_image_understanding=True)
+
+
+def _get_client() -> AsyncClient:
+    """Return the shared xAI client, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = AsyncClient(api_key=get_settings().xai_api_key)
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared xAI client's channels (called on app shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+async def _wait_for_request_budget(rpm: int) -> None:
+    """Wait until starting another xAI request stays within `rpm` per rolling minute."""
+    while True:
+        now = time.monotonic()
+        while _request_starts and _request_starts[0] <= now - 60:
+            _request_starts.popleft()
+        if len(_request_starts) < rpm:
+            _request_starts.append(now)
+            return
+        # Sleep until the oldest start leaves the window, then re-check
+        await asyncio.sleep(_request_starts[0] + 60 - now)
+
+
+@asynccontextmanager
+async def _request_slot() -> AsyncIterator[None]:
+    """
+    Hold an xAI request slot: at most XAI_MAX_CONCURRENCY requests in flight
+    and XAI_RPM started per minute, so bursts queue here instead of turning
+    into 429s from the API.
+    """
+    global _request_semaphore
+    settings = get_settings()
+    if _request_semaphore is None:
+        _request_semaphore = asyncio.Semaphore(settings.xai_max_concurrency)
+    async with _request_semaphore:
+        await _wait_for_request_budget(settings.xai_rpm)
+        yield
 
 
-def analyze_market(
+def _analysis_cache_key(**market: Any) -> bytes:
+    """
+    Cache key for an analyze_market call: a digest of all its arguments, with
+    the drifting market numbers bucketed. The portfolio is keyed exactly, since
+    the recommendation depends on it.
+    """
+    params = inspect.signature(_market_lines).bind(**market)
+    params.apply_defaults()
+    key = params.arguments
+    for field in _CACHE_PRICE_FIELDS:
+        if key[field] is not None:
+            key[field] = round(key[field], 2)
+    for field in _CACHE_MOMENTUM_FIELDS:
+        if key[field] is not None:
+            key[field] = round(key[field] * 200) / 200
+    for field in _CACHE_SIZE_FIELDS:
+        if key[field] is not None:
+            key[field] = float(f"{key[field]:.2g}")
+    return hashlib.blake2b(orjson.dumps(key, option=orjson.OPT_SORT_KEYS), digest_size=16).digest()
+
+
+def _pick_model_and_tools(
+    competitive: Optional[float],
+    days_until_resolution: Optional[int],
+    one_day_change: Optional[float],
+) -> Tuple[str, List[Any]]:
+    """
+    Choose the model and search tools for a market by how contested it is.
+
+    Lopsided, quiet markets that aren't resolving within a week go to
+    XAI_FAST_MODEL with web search only; close calls go to XAI_PREMIUM_MODEL.
+    Everything else - and either tier while its model isn't configured - uses
+    XAI_MODEL with web and X search.
+    """
+    settings = get_settings()
+    if (
+        settings.xai_fast_model
+        and competitive is not None and competitive < 0.3
+        and abs(one_day_change or 0) < 0.02
+        and (days_until_resolution is None or days_until_resolution > 7)
+    ):
+        return settings.xai_fast_model, [_WEB_SEARCH_TOOL]
+
+    # Calculate dynamic lookback period based on market volatility
+    # High volatility = focus on very recent info, low volatility = broader timeframe
+    lookback_days = 14  # Default lookback
+    if one_day_change and abs(one_day_change) > 0.10:
+        lookback_days = 3  # High volatility - very recent info only
+    elif one_day_change and abs(one_day_change) > 0.05:
+        lookback_days = 7  # Moderate volatility
+    elif days_until_resolution is not None and days_until_resolution <= 3:
+        lookback_days = 7  # Short time to resolution - focus on recent
+
+    search_start_date = datetime.now() - timedelta(days=lookback_days)
+
+    # Agentic search tools (web + X), with image/video understanding for
+    # visual context (charts, screenshots, etc.)
+    tools = [
+        _WEB_SEARCH_TOOL,
+        x_search(
+            from_date=search_start_date,
+            enable_image_understanding=True,
+            enable_video_understanding=True
+        ),
+    ]
+    if settings.xai_premium_model and competitive is not None and competitive > 0.7:
+        return settings.xai_premium_model, tools
+    return settings.xai_model, tools
+
+
+def _market_lines(
     question: str,
     current_price: float,
     description: Optional[str] = None,
@@ -26,112 +223,71 @@ def analyze_market(
     tags: Optional[list] = None,
     days_until_resolution: Optional[int] = None,
     portfolio: Optional[Dict[str, Any]] = None
-) -> Dict[str, Any]:
+) -> List[str]:
     """
-    Use AI with agentic search to analyze a prediction market.
-    Model is configurable via XAI_MODEL env var (default: grok-4-1-fast).
-    Returns estimated probability, reasoning, confidence, key events, and risks.
+    The prompt lines describing one market. Only the question and current
+    price are required; every other market field adds context when given.
     """
-    settings = get_settings()
-    client = Client(api_key=settings.xai_api_key)
-
-    # Calculate dynamic lookback period based on market volatility
-    # High volatility = focus on very recent info, low volatility = broader timeframe
-    lookback_days = 14  # Default lookback
-    if one_day_change and abs(one_day_change) > 0.10:
-        lookback_days = 3  # High volatility - very recent info only
-    elif one_day_change and abs(one_day_change) > 0.05:
-        lookback_days = 7  # Moderate volatility
-    elif days_until_resolution is not None and days_until_resolution <= 3:
-        lookback_days = 7  # Short time to resolution - focus on recent
-
-    search_start_date = datetime.now() - timedelta(days=lookback_days)
-
-    # Create chat with agentic search tools (web + X)
-    # Enable image/video understanding for visual context (charts, screenshots, etc.)
-    chat = client.chat.create(
-        model=settings.xai_model,
-        tools=[
-            web_search(enable_image_understanding=True),
-            x_search(
-                from_date=search_start_date,
-                enable_image_understanding=True,
-                enable_video_understanding=True
-            ),
-        ],
-    )
-
-    # Build context section with all available market data
-    context_parts = [f"CURRENT MARKET PRICE: {current_price:.1%}"]
+    # One line per entry, joined by the caller: the question, then all
+    # available market data, then the portfolio if given
+    lines = [f"MARKET QUESTION: {question}\n", f"CURRENT MARKET PRICE: {current_price:.1%}"]
 
     if description:
-        context_parts.append(f"RESOLUTION CRITERIA: {description[:1500]}")
+        lines.append(f"RESOLUTION CRITERIA: {description[:600]}")
     if end_date:
-        context_parts.append(f"RESOLUTION DATE: {end_date}")
+        lines.append(f"RESOLUTION DATE: {end_date}")
     if days_until_resolution is not None:
         if days_until_resolution == 0:
-            context_parts.append("TIME TO RESOLUTION: TODAY (imminent)")
+            lines.append("TIME TO RESOLUTION: TODAY (imminent)")
         elif days_until_resolution <= 7:
-            context_parts.append(f"TIME TO RESOLUTION: {days_until_resolution} days (short-term)")
+            lines.append(f"TIME TO RESOLUTION: {days_until_resolution} days (short-term)")
         else:
-            context_parts.append(f"TIME TO RESOLUTION: {days_until_resolution} days")
-
-    # Price momentum - very important for analysis
-    momentum_parts = []
-    if one_hour_change is not None and one_hour_change != 0:
-        direction = "↑" if one_hour_change > 0 else "↓"
-        momentum_parts.append(f"1h: {direction}{abs(one_hour_change)*100:.1f}%")
-    if one_day_change is not None and one_day_change != 0:
-        direction = "↑" if one_day_change > 0 else "↓"
-        momentum_parts.append(f"24h: {direction}{abs(one_day_change)*100:.1f}%")
-    if one_week_change is not None and one_week_change != 0:
-        direction = "↑" if one_week_change > 0 else "↓"
-        momentum_parts.append(f"7d: {direction}{abs(one_week_change)*100:.1f}%")
-    if one_month_change is not None and one_month_change != 0:
-        direction = "↑" if one_month_change > 0 else "↓"
-        momentum_parts.append(f"30d: {direction}{abs(one_month_change)*100:.1f}%")
+            lines.append(f"TIME TO RESOLUTION: {days_until_resolution} days")
+
+    # Price momentum - very important for analysis (unchanged windows are left out)
+    momentum_parts = [
+        f"{label}: {'↑' if change > 0 else '↓'}{abs(change)*100:.1f}%"
+        for label, change in zip(
+            _MOMENTUM_LABELS, (one_hour_change, one_day_change, one_week_change, one_month_change)
+        )
+        if change
+    ]
     if momentum_parts:
-        context_parts.append(f"PRICE MOMENTUM: {', '.join(momentum_parts)}")
+        lines.append(f"PRICE MOMENTUM: {', '.join(momentum_parts)}")
 
     # Volume and liquidity - indicates market quality
-    if volume_24h is not None and volume_24h > 0:
-        context_parts.append(f"24H TRADING VOLUME: ${volume_24h:,.0f}")
-    if volume_1w is not None and volume_1w > 0:
-        context_parts.append(f"7D TRADING VOLUME: ${volume_1w:,.0f}")
-    if liquidity is not None and liquidity > 0:
-        context_parts.append(f"MARKET LIQUIDITY: ${liquidity:,.0f}")
+    for label, amount in zip(_SIZE_LABELS, (volume_24h, volume_1w, liquidity)):
+        if amount is not None and amount > 0:
+            lines.append(f"{label}: ${amount:,.0f}")
     if spread is not None:
-        context_parts.append(f"BID-ASK SPREAD: {spread:.1%}")
+        lines.append(f"BID-ASK SPREAD: {spread:.1%}")
 
     # Engagement and competitiveness
     if comment_count is not None and comment_count > 0:
-        context_parts.append(f"COMMUNITY DISCUSSION: {comment_count} comments")
+        lines.append(f"COMMUNITY DISCUSSION: {comment_count} comments")
     if competitive is not None:
         if competitive > 0.7:
-            context_parts.append(f"COMPETITIVENESS: High ({competitive:.0%}) - market is close/uncertain")
+            lines.append(f"COMPETITIVENESS: High ({competitive:.0%}) - market is close/uncertain")
         elif competitive > 0.3:
-            context_parts.append(f"COMPETITIVENESS: Medium ({competitive:.0%})")
+            lines.append(f"COMPETITIVENESS: Medium ({competitive:.0%})")
         else:
-            context_parts.append(f"COMPETITIVENESS: Low ({competitive:.0%}) - outcome seems clear")
+            lines.append(f"COMPETITIVENESS: Low ({competitive:.0%}) - outcome seems clear")
 
     # Category tags
     if tags and len(tags) > 0:
-        context_parts.append(f"CATEGORIES: {', '.join(tags[:5])}")
+        lines.append(f"CATEGORIES: {', '.join(tags[:5])}")
 
-    context = "\n".join(context_parts)
-
-    # Build portfolio context if available
-    portfolio_context = ""
+    # Portfolio context if available
     if portfolio:
         balance = portfolio.get("balance", 0)
         total_pnl = portfolio.get("total_pnl", 0)
         active_trades = portfolio.get("active_trades", [])
 
-        portfolio_parts = [
-            f"\n\nPORTFOLIO STATUS:",
+        lines.extend((
+            "\nPORTFOLIO STATUS:",
             f"Available Balance: ${balance:,.2f}",
             f"Total P&L: ${total_pnl:+,.2f}"
-        ]
+        ))
 
         # Check for existing position in this market
         existing_position = None
@@ -141,97 +297,110 @@ def analyze_market(
                 break
 
         if existing_position:
-            portfolio_parts.append(f"\nEXISTING POSITION IN THIS MARKET:")
-            portfolio_parts.append(f"  Direction: {existing_position.get('direction')}")
-            portfolio_parts.append(f"  Amount: ${existing_position.get('amount', 0):,.2f}")
-            portfolio_parts.append(f"  Entry Price: {existing_position.get('entry_price', 0):.1%}")
+            lines.append(f"\nEXISTING POSITION IN THIS MARKET:")
+            lines.append(f"  Direction: {existing_position.get('direction')}")
+            lines.append(f"  Amount: ${existing_position.get('amount', 0):,.2f}")
+            lines.append(f"  Entry Price: {existing_position.get('entry_price', 0):.1%}")
             if existing_position.get('pnl') is not None:
-                portfolio_parts.append(f"  Current P&L: ${existing_position.get('pnl', 0):+,.2f}")
+                lines.append(f"  Current P&L: ${existing_position.get('pnl', 0):+,.2f}")
 
         if active_trades and len(active_trades) > 0:
-            portfolio_parts.append(f"\nOTHER ACTIVE TRADES: {len(active_trades)} positions")
+            lines.append(f"\nOTHER ACTIVE TRADES: {len(active_trades)} positions")
 
-        portfolio_context = "\n".join(portfolio_parts)
+    return lines
 
-    # Build prompt with or without portfolio
-    recommendation_section = ""
-    if portfolio:
-        recommendation_section = """,
-    "recommendation": {{
-        "action": "<BUY_YES|BUY_NO|HOLD|SKIP>",
-        "amount": <recommended USDC amount or null if SKIP/HOLD>,
-        "reasoning": "<why this specific trade recommendation>",
-        "risk_level": "<low|medium|high>",
-        "kelly_fraction": <optimal bet size as decimal 0.0-1.0 based on edge and confidence>
-    }}"""
 
-    prompt = f"""You are an expert prediction market analyst and portfolio manager. Analyze this market and provide a probability estimate with a specific trade recommendation.
+def _create_chat(model: str, tools: List[Any], system_prompt: str, prompt: str) -> Chat:
+    """Create an agentic-search chat in JSON mode with its messages appended."""
+    chat = _get_client().chat.create(
+        model=model,
+        tools=tools,
+        # JSON mode - the reply is the JSON object alone, no prose around it
+        response_format="json_object",
+    )
+    # Static instructions first, then only the market details
+    chat.append(system(system_prompt))
+    chat.append(user(prompt))
+    return chat
 
-MARKET QUESTION: {question}
 
-{context}{portfolio_context}
+def _build_chat(**market: Any) -> Chat:
+    """
+    Create the agentic-search chat for one market (the _market_lines
+    arguments) with its analysis prompt appended, ready to sample or stream.
+    """
+    model, tools = _pick_model_and_tools(
+        market.get("competitive"), market.get("days_until_resolution"), market.get("one_day_change")
+    )
+    return _create_chat(model, tools, _SYSTEM_PROMPT, "\n".join(_market_lines(**market)))
 
-TASK:
-1. Search the web for current news, data, and expert opinions relevant to this question
-2. Search X/Twitter for real-time sentiment, breaking news, and insider perspectives
-3. Search for "Polymarket {question}" to find community discussion and contrarian takes - traders often post obscure rules, debunking evidence, or resolution criteria details in comments
-4. Pay attention to images and charts in search results - polling data, screenshots of official statements, etc.
-5. Consider the resolution criteria carefully
-6. Analyze price momentum (recent price changes may indicate new information)
-7. RED TEAM YOUR THESIS: Actively search for evidence that contradicts your initial hunch. What could make you wrong?
-8. Estimate the TRUE probability this event will resolve YES
-9. Provide a specific trade recommendation based on edge, confidence, and portfolio status
 
-Return your analysis as a JSON object with this EXACT structure:
-{{
-    "estimated_probability": <float between 0.0 and 1.0>,
-    "confidence": "<low|medium|high>",
-    "reasoning": "<detailed multi-paragraph analysis with line breaks between sections>",
-    "key_events": ["<upcoming event/date 1>", "<upcoming event/date 2>"],
-    "risks": ["<risk to your thesis 1>", "<risk to your thesis 2>"],
-    "sources": ["<url1>", "<url2>", ...]{recommendation_section}
-}}
-
-GUIDELINES:
-- Be precise with probability. Don't default to 50%.
-- If market has moved significantly, explain why (new information?)
-- For "confidence": use "high" only if evidence is strong and recent
-- List specific upcoming dates/events that could move the market
-- Acknowledge risks that could invalidate your analysis
-- Use line breaks in reasoning for readability
-
-CRITICAL - RESPECT MARKET WISDOM:
-- If market is < 20% or > 80%, assume the market knows something you don't
-- To bet against extreme prices, you need EXTRAORDINARY evidence (official statements, leaked docs, etc.)
-- Don't confidently contradict a 5% or 95% market without smoking-gun evidence
-- Markets aggregate information from thousands of traders - be humble
-
-TRADE RECOMMENDATION GUIDELINES:
-- BUY_YES: If your probability > market price (positive edge on YES)
-- BUY_NO: If your probability < market price (positive edge on NO)
-- HOLD: If already have a position and should keep it
-- SKIP: If edge is too small (<5%), confidence is low, or risk is too high
-- Amount should be based on Kelly Criterion: edge * balance / odds, but be conservative (use fractional Kelly ~25%)
-- Never recommend more than 10% of balance on a single trade
-- Consider existing positions - don't double down recklessly
-- If balance is low (<$50), recommend smaller amounts
-
-Only return the JSON object, no other text."""
-
-    # Add user message and get response
-    chat.append(user(prompt))
-    response = chat.sample()
+def _build_batch_chat(markets: List[Dict[str, Any]]) -> Chat:
+    """
+    Create one chat covering several related markets, each in its own
+    numbered section. The model and tools are picked for the most contested,
+    fastest-moving and soonest-resolving market of the group.
+    """
+    def known(field: str) -> List[Any]:
+        return [m[field] for m in markets if m.get(field) is not None]
 
-    content = response.content
+    model, tools = _pick_model_and_tools(
+        max(known("competitive"), default=None),
+        min(known("days_until_resolution"), default=None),
+        max(known("one_day_change"), key=abs, default=None),
+    )
+    lines = [f"{len(markets)} RELATED MARKETS"]
+    for number, market in enumerate(markets, 1):
+        lines.append(f"\n=== MARKET {number} ===")
+        lines.extend(_market_lines(**market))
+    return _create_chat(model, tools, _BATCH_SYSTEM_PROMPT, "\n".join(lines))
+
+
+def _extract_json(text: str) -> Optional[str]:
+    """
+    Return the first complete {...} object in text, or None if there isn't one.
 
-    # Parse JSON from response
+    Scans once from the first "{", tracking nesting depth and skipping over
+    string literals, so braces inside quoted reasoning or trailing prose after
+    the object don't throw off the match.
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+    depth = 0
+    in_string = False
+    escape = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+
+def _parse_analysis(content: str, citations: List[str], market: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Parse and sanitize the model's JSON answer for `market` (the _market_lines
+    arguments), merging in the search citations.
+    """
+    current_price = market["current_price"]
+    # Parse JSON from response - the model sometimes wraps it in prose or a
+    # code fence, so pull out the object itself first
     try:
-        json_match = re.search(r'\{[\s\S]*\}', content)
-        if json_match:
-            result = json.loads(json_match.group())
-        else:
-            result = json.loads(content)
-    except json.JSONDecodeError:
+        result = orjson.loads(_extract_json(content) or content)
+    except orjson.JSONDecodeError:
         result = {
             "estimated_probability": current_price,
             "confidence": "low",
@@ -240,40 +409,148 @@ Only return the JSON object, no other text."""
             "risks": [],
             "sources": []
         }
+    return _sanitize_analysis(result, citations, market)
+
 
-    # Ensure required fields exist
-    result.setdefault("confidence", "medium")
-    result.setdefault("key_events", [])
-    result.setdefault("risks", [])
-    result.setdefault("sources", [])
+def _sanitize_analysis(result: Dict[str, Any], citations: List[str], market: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill in defaults and validate one decoded analysis object for `market`."""
+    current_price = market["current_price"]
 
-    # Ensure probability is valid
+    # Ensure required fields exist - one merge over fresh defaults, the model's
+    # values win
+    result = {"confidence": "medium", "key_events": [], "risks": [], "sources": [], **result}
+
+    # Ensure probability is valid, accepting "65%"-style strings, clamped to [0, 1]
     prob = result.get("estimated_probability", current_price)
     if isinstance(prob, str):
         prob = float(prob.strip('%')) / 100 if '%' in prob else float(prob)
-    result["estimated_probability"] = max(0.0, min(1.0, prob))
+    else:
+        prob = float(prob)
+    result["estimated_probability"] = 0.0 if prob < 0.0 else 1.0 if prob > 1.0 else prob
+
+    # The schema always lists a recommendation; it only applies with a portfolio
+    if not market.get("portfolio"):
+        result.pop("recommendation", None)
 
-    # Validate recommendation if present
+    # Validate recommendation if present, into the API schema itself so the
+    # endpoints can pass it straight through
     if "recommendation" in result and result["recommendation"]:
-        rec = result["recommendation"]
-        # Ensure valid action
-        valid_actions = ["BUY_YES", "BUY_NO", "HOLD", "SKIP"]
-        if rec.get("action") not in valid_actions:
-            rec["action"] = "SKIP"
-        # Ensure valid risk level
-        if rec.get("risk_level") not in ["low", "medium", "high"]:
-            rec["risk_level"] = "medium"
-        # Ensure amount is reasonable
-        if rec.get("amount") is not None:
-            rec["amount"] = max(0, float(rec["amount"]))
-        # Ensure kelly fraction is valid
-        if rec.get("kelly_fraction") is not None:
-            rec["kelly_fraction"] = max(0.0, min(1.0, float(rec["kelly_fraction"])))
-
-    # Add citations from agentic search
-    if hasattr(response, 'citations') and response.citations:
-        existing_sources = result.get("sources", [])
-        result["sources"] = list(set(existing_sources + list(response.citations)))
+        result["recommendation"] = TradeRecommendation.model_validate(result["recommendation"])
+
+    # Add citations from agentic search, deduplicated in order - the model's
+    # own sources first, then any extra citations
+    if citations:
+        result["sources"] = list(dict.fromkeys(chain(result["sources"], citations)))
 
     return result
 
+
+@async_ttl_cache(ttl=ANALYSIS_CACHE_TTL, key=_analysis_cache_key)
+async def analyze_market(**market: Any) -> Dict[str, Any]:
+    """
+    Use AI with agentic search to analyze a prediction market, given the
+    market fields _market_lines takes as keyword arguments.
+    Model is configurable via XAI_MODEL env var (default: grok-4-1-fast).
+    Returns estimated probability, reasoning, confidence, key events, and risks.
+    Results are reused for ANALYSIS_CACHE_TTL seconds when the inputs only
+    drift slightly, and are shared between callers - treat them as read-only.
+    """
+    chat = _build_chat(**market)
+    async with _request_slot():
+        response = await chat.sample()
+    return _parse_analysis(response.content, response.citations, market)
+
+
+async def stream_market_analysis(**market: Any) -> AsyncIterator[Dict[str, Any]]:
+    """
+    The same analysis as analyze_market, streamed: yields {"delta": text} as
+    the model writes, then {"result": analysis} once the response is complete
+    and parsed. Streams always run fresh and are not cached.
+    """
+    chat = _build_chat(**market)
+    response = None
+    async with _request_slot():
+        async for response, chunk in chat.stream():
+            if chunk.content:
+                yield {"delta": chunk.content}
+    if response is None:
+        content, citations = "", []
+    else:
+        content, citations = response.content, response.citations
+    yield {"result": _parse_analysis(content, citations, market)}
+
+
+async def analyze_markets(batch: List[Dict[str, Any]], concurrency: int = 8) -> List[Dict[str, Any]]:
+    """
+    Analyze several markets concurrently, at most `concurrency` at a time.
+
+    Each item holds analyze_market's keyword arguments; results come back in
+    batch order. Markets analyzed recently with similar inputs are answered
+    from analyze_market's cache.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def analyze_one(market: Dict[str, Any]) -> Dict[str, Any]:
+        async with semaphore:
+            return await analyze_market(**market)
+
+    return await asyncio.gather(*(analyze_one(market) for market in batch))
+
+
+async def analyze_markets_batch(
+    markets: List[Dict[str, Any]], on_extra_calls: Optional[Callable[[int], None]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Analyze a group of related markets in one xAI call, so the agentic search
+    runs once for the whole group instead of once per market.
+
+    Each item holds analyze_market's keyword arguments; results come back in
+    input order. Group markets by tags before calling: a single market, an
+    untagged group or a group whose tags differ falls back to analyze_markets,
+    since nothing says those markets are related. So does any
+    market the batched answer leaves out or garbles. Search citations can't be
+    attributed to one market, so batched results carry only the sources the
+    model cites itself, and they are not cached.
+
+    `on_extra_calls`, if given, is told how many analyses beyond the one
+    batched call a fallback is about to run, so callers can budget for them.
+    """
+    tags = {tuple(m.get("tags") or ()) for m in markets}
+    if len(markets) < 2 or len(tags) > 1 or not next(iter(tags)):
+        if on_extra_calls is not None and len(markets) > 1:
+            on_extra_calls(len(markets) - 1)
+        return await analyze_markets(markets)
+
+    chat = _build_batch_chat(markets)
+    async with _request_slot():
+        response = await chat.sample()
+
+    try:
+        analyses = orjson.loads(_extract_json(response.content) or response.content)
+    except orjson.JSONDecodeError:
+        analyses = None
+    if isinstance(analyses, dict):
+        analyses = analyses.get("analyses")
+    if not isinstance(analyses, list):
+        analyses = []
+
+    # Route answers back by position; anything missing or malformed is
+    # analyzed on its own
+    results: List[Optional[Dict[str, Any]]] = [None] * len(markets)
+    retry = []
+    for index, market in enumerate(markets):
+        analysis = analyses[index] if index < len(analyses) else None
+        try:
+            # The endpoints need the reasoning; without it the answer is garbled
+            if "reasoning" not in analysis:
+                raise ValueError("batched analysis has no reasoning")
+            results[index] = _sanitize_analysis(analysis, [], market)
+        except (TypeError, ValueError):
+            retry.append(index)
+
+    if retry:
+        if on_extra_calls is not None:
+            on_extra_calls(len(retry))
+        for index, result in zip(retry, await analyze_markets([markets[i] for i in retry])):
+            results[index] = result
+    return results
@@ -19,7 +19,7 @@ export async function fetchTopOpportunities(limit = 10) {
   return response.json();
 }
 
-export async function analyzeMarket(market, portfolio = null) {
+export async function analyzeMarket(market, portfolio = null, refresh = false) {
   const body = {
     market_id: market.id,
     question: market.question,
@@ -40,7 +40,9 @@ export async function analyzeMarket(market, portfolio = null) {
     comment_count: market.comment_count,
     competitive: market.competitive,
     tags: market.tags,
-    days_until_resolution: market.days_until_resolution
+    days_until_resolution: market.days_until_resolution,
+    // Bypass the server's short-lived analysis cache
+    refresh
   };
 
   // Add portfolio context if available
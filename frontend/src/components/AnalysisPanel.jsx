@@ -52,7 +52,7 @@ function AnalysisPanel({ market, preloadedAnalysis, onAnalysisComplete, portfoli
     }
   };
 
-  const handleAnalyze = async () => {
+  const handleAnalyze = async (refresh = false) => {
     if (!market) return;
 
     setLoading(true);
@@ -60,7 +60,7 @@ function AnalysisPanel({ market, preloadedAnalysis, onAnalysisComplete, portfoli
     setAnalysis(null);
 
     try {
-      const result = await analyzeMarket(market, portfolio);
+      const result = await analyzeMarket(market, portfolio, refresh);
       setAnalysis(result);
 
       // Save to InstantDB history
@@ -165,7 +165,7 @@ function AnalysisPanel({ market, preloadedAnalysis, onAnalysisComplete, portfoli
       {/* Analysis Button */}
       {!analysis && !loading && (
         <button
-          onClick={handleAnalyze}
+          onClick={() => handleAnalyze()}
           className="btn-primary w-full py-4 text-lg"
         >
           🔍 Run AI Analysis
@@ -188,7 +188,7 @@ function AnalysisPanel({ market, preloadedAnalysis, onAnalysisComplete, portfoli
         <div className="p-4 border border-black bg-bg-light mb-4">
           <div className="text-black font-medium">Analysis Failed</div>
           <div className="text-sm text-text-dark mt-1">{error}</div>
-          <button onClick={handleAnalyze} className="btn-secondary mt-3 text-sm">
+          <button onClick={() => handleAnalyze()} className="btn-secondary mt-3 text-sm">
             Retry
           </button>
         </div>
@@ -324,7 +324,7 @@ function AnalysisPanel({ market, preloadedAnalysis, onAnalysisComplete, portfoli
 
           {/* Re-analyze button */}
           <button
-            onClick={handleAnalyze}
+            onClick={() => handleAnalyze(true)}
             className="btn-secondary w-full text-sm"
           >
             Re-analyze Market